@@ -0,0 +1,127 @@
+[idmefv2-connector]
+param.idmefv2_endpoint = <string>
+* IDMEFv2 endpoint to send the messages to.
+
+param.batch_mode = <bool>
+* When enabled, every row of the alert's results file is converted and sent,
+  otherwise only the first result.
+* Only enable it for alerts triggered once per search: an alert triggered
+  for each result runs the action once per result with the same results file,
+  which would send every result again on each run.
+* Default: 0
+
+param.use_forwarder = <bool>
+* When enabled, the alert action hands the payload off to the local forwarder
+  (bin/idmefv2-connector.py --forwarder) and returns immediately. The payload
+  is processed in the alert action itself when no forwarder is running.
+* Default: 0
+
+param.forwarder_socket = <string>
+* Unix socket of the local forwarder.
+* Default: $SPLUNK_HOME/var/run/splunk/idmefv2_forwarder.sock
+
+param.pool_size = <integer>
+* Number of HTTP connections kept open to the endpoint.
+* Default: 4
+
+param.keep_alive = <bool>
+* Reuse the HTTP connections for every message sent by the process.
+* Default: 1
+
+param.connect_timeout = <decimal>
+* Seconds to wait for the connection to the endpoint.
+* Default: 5
+
+param.read_timeout = <decimal>
+* Seconds to wait for the response of the endpoint.
+* Default: 30
+
+param.bulk_format = none|json|ndjson
+* "none" sends one request per IDMEFv2 message.
+* "json" sends batches of messages as a JSON array, "ndjson" as
+  newline-delimited JSON. A batch rejected with status 400, 413 or 422 is
+  split in half until the failing messages are isolated.
+* Default: none
+
+param.bulk_max_messages = <integer>
+* Maximum number of messages in a batch.
+* Default: 500
+
+param.bulk_max_bytes = <integer>
+* Maximum size in bytes of a batch body.
+* Default: 4194304
+
+param.bulk_linger = <decimal>
+* Seconds the forwarder waits for more messages before sending an incomplete
+  batch. The alert action sends its last batch when it ends.
+* Default: 1
+
+param.spool_enabled = <bool>
+* Messages that can't be delivered (connection errors, 408, 429 and 5xx
+  statuses) are written to $SPLUNK_HOME/var/spool/idmefv2 and replayed later,
+  with an exponentially growing delay between attempts. While the endpoint is
+  backing off, new messages are spooled without trying to send them. Each
+  endpoint has its own queue and backoff, an unavailable endpoint doesn't delay
+  the messages of the others.
+* Default: 1
+
+param.spool_max_bytes = <integer>
+* Maximum size of the spool; the oldest messages are dropped beyond it.
+* Default: 268435456
+
+param.delivery_mode = sync|async
+* "sync" sends one request at a time.
+* "async" keeps several requests in flight with an asyncio engine, while the
+  next results are converted. Bulk batches are not split to isolate rejected
+  messages in this mode.
+* Default: sync
+
+param.async_concurrency = <integer>
+* Maximum number of requests in flight in async mode.
+* Default: 8
+
+param.async_endpoint_concurrency = <integer>
+* Maximum number of requests in flight to the same endpoint in async mode.
+* Default: 8
+
+param.async_queue_size = <integer>
+* Requests waiting to be sent before the conversion is paused, in async mode.
+* Default: 1000
+
+param.payload_log_level = DEBUG|INFO|WARNING|ERROR|NONE
+* Level at which the payloads, results and generated IDMEFv2 messages are
+  written to idmefv2_connector.log, which logs at INFO. They are serialized
+  only when written, so the default DEBUG level costs nothing. NONE disables
+  them.
+* Default: DEBUG
+
+param.payload_log_max_chars = <integer>
+* Logged payloads are truncated to this number of characters, 0 for no limit.
+* Default: 4096
+
+param.payload_log_sample_rate = <float>
+* Fraction of the results whose records are logged, between 0 and 1.
+* Default: 1.0
+
+param.metrics_enabled = <bool>
+* Writes the time spent in each stage (parse, prepare, classify, convert,
+  send) and the delivery counters as one JSON line per alert action to
+  $SPLUNK_HOME/var/log/splunk/idmefv2_connector_metrics.log, or once per
+  interval in the forwarder. The "metric_name:" keys can be ingested into a
+  metrics index.
+* Default: 1
+
+param.compression = none|gzip|deflate|zstd
+* Compresses the request bodies and sets their Content-Encoding header. The
+  endpoint must accept compressed requests. zstd requires the zstandard
+  package in the app's lib directory, gzip is used without it.
+* Default: none
+
+param.compression_level = <integer>
+* Compression level, 0 for the default level of the method (6 for gzip and
+  deflate, 3 for zstd).
+* Default: 0
+
+param.compression_min_bytes = <integer>
+* Bodies smaller than this number of bytes are sent uncompressed.
+* Default: 1024
@@ -1,5 +1,29 @@
 action.idmefv2-connector.param.idmefv2_endpoint = <string>
 action.idmefv2-connector.param.severity = <string>
+action.idmefv2-connector.param.batch_mode = <bool>
+action.idmefv2-connector.param.use_forwarder = <bool>
+action.idmefv2-connector.param.forwarder_socket = <string>
+action.idmefv2-connector.param.pool_size = <integer>
+action.idmefv2-connector.param.keep_alive = <bool>
+action.idmefv2-connector.param.connect_timeout = <decimal>
+action.idmefv2-connector.param.read_timeout = <decimal>
+action.idmefv2-connector.param.bulk_format = none|json|ndjson
+action.idmefv2-connector.param.bulk_max_messages = <integer>
+action.idmefv2-connector.param.bulk_max_bytes = <integer>
+action.idmefv2-connector.param.bulk_linger = <decimal>
+action.idmefv2-connector.param.spool_enabled = <bool>
+action.idmefv2-connector.param.spool_max_bytes = <integer>
+action.idmefv2-connector.param.delivery_mode = sync|async
+action.idmefv2-connector.param.async_concurrency = <integer>
+action.idmefv2-connector.param.async_endpoint_concurrency = <integer>
+action.idmefv2-connector.param.async_queue_size = <integer>
+action.idmefv2-connector.param.payload_log_level = DEBUG|INFO|WARNING|ERROR|NONE
+action.idmefv2-connector.param.payload_log_max_chars = <integer>
+action.idmefv2-connector.param.payload_log_sample_rate = <float>
+action.idmefv2-connector.param.metrics_enabled = <bool>
+action.idmefv2-connector.param.compression = none|gzip|deflate|zstd
+action.idmefv2-connector.param.compression_level = <integer>
+action.idmefv2-connector.param.compression_min_bytes = <integer>
 
 
 
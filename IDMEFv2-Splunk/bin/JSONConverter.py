@@ -1,11 +1,128 @@
 '''
     Generic JSON to JSON converter
+
+    A template is a dict or list of constants and JSON Paths ("$.a.b"), whose calls are written
+    either {"$fn": "name", "args": [...]} with a registered function, as in JSON or YAML
+    template files, or (callable, arg, ...) tuples
 '''
-import jsonpath_ng as jsonpath
+import os
+import json
+import io
+import pickle
 import logging
 
+# jsonpath_ng and its PLY parser are imported on first use,
+# a template loaded from the cache made of plain $.a.b paths does not need them
+jsonpath = None
+
+# Marker of a field missing from the source, None being a valid value
+_MISSING = object()
+
+# Version of the compiled template cache files
+CACHE_VERSION = 1
+
+def _jsonpath():
+    global jsonpath
+    if jsonpath is None:
+        import jsonpath_ng as jsonpath
+    return jsonpath
+
+class _Path(object):
+    '''
+        A compiled JSON Path. The field names of a plain $.a.b path are kept,
+        so that it is evaluated and cached without its jsonpath_ng expression
+    '''
+    __slots__ = ('source', 'text', 'fields', '_expression')
+
+    def __init__(self, source: str, expression: 'jsonpath.JSONPath', fields: tuple):
+        self.source = source
+        # Text of the path in the warnings
+        self.text = str(expression)
+        self.fields = fields
+        self._expression = expression
+
+    def expression(self) -> 'jsonpath.JSONPath':
+        if self._expression is None:
+            self._expression = _jsonpath().parse(self.source)
+        return self._expression
+
+    def __getstate__(self):
+        # Plain paths are cached as their field names only
+        return (self.source, self.text, self.fields, None if self.fields is not None else self._expression)
+
+    def __setstate__(self, state):
+        self.source, self.text, self.fields, self._expression = state
+
+class _Pickler(pickle.Pickler):
+    '''
+        Pickles the registered callables of a template by name
+    '''
+    def __init__(self, file, names: dict):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.names = names
+
+    def persistent_id(self, obj):
+        try:
+            return self.names.get(obj)
+        except TypeError:
+            return None
+
+class _Unpickler(pickle.Unpickler):
+    '''
+        Resolves the callables of a cached template in the registry
+    '''
+    def persistent_load(self, pid):
+        try:
+            return JSONConverter.functions[pid]
+        except KeyError:
+            raise pickle.UnpicklingError(f"function '{pid}' is not registered")
+
+class _Batch(object):
+    '''
+        Sources given as columns, the rows being built only if a JSON Path needs them
+    '''
+    __slots__ = ('columns', 'size', '_rows')
+
+    def __init__(self, columns: dict, size: int):
+        sizes = {len(column) for column in columns.values()}
+        if sizes - {size}:
+            raise ValueError(f"Columns of lengths {sorted(sizes)} for {size} rows")
+        self.columns = columns
+        self.size = size
+        self._rows = None
+
+    def rows(self) -> list:
+        if self._rows is None:
+            if self.columns:
+                names = tuple(self.columns)
+                self._rows = [dict(zip(names, values)) for values in zip(*self.columns.values())]
+            else:
+                self._rows = [{} for _ in range(self.size)]
+        return self._rows
+
 class JSONConverter(object):
 
+    # Named callables of the templates, by name: the compiled templates
+    # refer to them by name in the cache, lambdas can't be pickled
+    functions = {}
+
+    @staticmethod
+    def register(name: str, fun: callable = None):
+        '''
+            Register a template callable under a name
+
+            Can be used as a decorator, @JSONConverter.register('name')
+
+            Parameters:
+                name(str): the name of the callable in the cached templates
+                fun(callable): the callable
+            Returns: the callable
+        '''
+        if fun is None:
+            return lambda f: JSONConverter.register(name, f)
+        JSONConverter.functions[name] = fun
+        return fun
+
     @staticmethod
     def __compile_template(template: any):
         '''
@@ -16,7 +133,10 @@ class JSONConverter(object):
             Returns: the compiled template
         '''
         if isinstance(template, str) and template.startswith('$'):
-            return jsonpath.parse(template)
+            expression = _jsonpath().parse(template)
+            return _Path(template, expression, JSONConverter.__simple_fields(expression))
+        if isinstance(template, dict) and '$fn' in template:
+            return JSONConverter.__compile_fn(template)
         if isinstance(template, dict):
             c = {k: JSONConverter.__compile_template(v) for (k, v) in template.items()}
             return c
@@ -28,14 +148,174 @@ class JSONConverter(object):
             return c
         return template
 
-    def __init__(self, template: dict):
+    @staticmethod
+    def __compile_fn(template: dict):
+        '''
+            Compile a {"$fn": "name", "args": [...]} call into a (function, arg, ...) tuple
+        '''
+        name = template['$fn']
+        args = template.get('args', [])
+        unknown = set(template) - {'$fn', 'args'}
+        if unknown:
+            raise ValueError(f"Unexpected keys {sorted(unknown)} in the call of '{name}'")
+        if not isinstance(args, list):
+            raise ValueError(f"The args of '{name}' must be a list")
+        fun = JSONConverter.functions.get(name)
+        if fun is None:
+            raise ValueError(f"Unknown function '{name}', expected one of {', '.join(sorted(JSONConverter.functions))}")
+        if not args:
+            return fun
+        return (fun,) + tuple(JSONConverter.__compile_template(v) for v in args)
+
+    @staticmethod
+    def load_template(path: str) -> dict:
+        '''
+            Load a template file, in JSON or in YAML (.yaml, .yml) when PyYAML is installed
+
+            Parameters:
+                path(str): the template file
+            Returns: the template, to pass to JSONConverter
+        '''
+        with open(path, 'rb') as f:
+            content = f.read()
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f"PyYAML is required to load the YAML template {path}")
+            return yaml.safe_load(content)
+        return json.loads(content)
+
+    def __init__(self, template: dict, fast_paths: bool = True, omit_none: bool = False, cache_dir: str = None,
+                 cache_name: str = None):
         '''
             Initialize converter by parsing JSON Path elements contained in template
 
             Parameters:
                 template(dict): the template of conversion output
+                fast_paths(bool): evaluate plain $.a.b paths with dict lookups
+                    instead of jsonpath_ng
+                omit_none(bool): leave the None values out of the output
+                    dicts and lists while building them
+                cache_dir(str): directory of the compiled templates cache,
+                    used when every callable of the template is registered
+                cache_name(str): name of the template in the cache, e.g. its file path:
+                    the cached versions of an edited template are removed
+        '''
+        self._compiled_template = JSONConverter.__load_template(template, cache_dir, cache_name)
+        self._convert = JSONConverter.__build(self._compiled_template, fast_paths, omit_none)
+        self._fast_paths = fast_paths
+        self._omit_none = omit_none
+        # Built on the first convert_many()
+        self._convert_columns = None
+
+    @staticmethod
+    def __describe(template: any, names: dict) -> str:
+        '''
+            Describe a template as a string, its callables by registered name
+
+            Raises KeyError if a callable is not registered
+        '''
+        if callable(template):
+            # Names are not quoted, they can't be mistaken for a string
+            return '@' + names[template]
+        if isinstance(template, dict):
+            return '{' + ','.join(repr(k) + ':' + JSONConverter.__describe(v, names) for (k, v) in template.items()) + '}'
+        if isinstance(template, list):
+            return '[' + ','.join(JSONConverter.__describe(v, names) for v in template) + ']'
+        if isinstance(template, tuple):
+            return '(' + ','.join(JSONConverter.__describe(v, names) for v in template) + ')'
+        return repr(template)
+
+    @staticmethod
+    def __load_template(template: any, cache_dir: str, cache_name: str = None):
+        '''
+            Compile a template, or load it from the cache when it was already compiled
+
+            The cache file name is the hash of the template definition and the cache version,
+            prefixed by the hash of the template name if any, the version of jsonpath_ng
+            is checked when the template has complex JSON Paths
+
+            Parameters:
+                template(dict): the template of conversion output
+                cache_dir(str): directory of the cache files, None to always compile
+                cache_name(str): name of the template, whose other cache files are
+                    removed when it is compiled
+            Returns: the compiled template
+        '''
+        if not cache_dir:
+            return JSONConverter.__compile_template(template)
+        names = {fun: name for (name, fun) in JSONConverter.functions.items()}
+        try:
+            description = JSONConverter.__describe(template, names)
+        except KeyError:
+            logging.debug("[JSONConverter] Template with unregistered callables, not cached")
+            return JSONConverter.__compile_template(template)
+
+        import hashlib
+        key = hashlib.sha256(f"{CACHE_VERSION}\0{description}".encode('utf-8')).hexdigest()
+        prefix = "template-"
+        if cache_name:
+            prefix += hashlib.sha256(cache_name.encode('utf-8')).hexdigest()[:16] + "-"
+        cache_path = os.path.join(cache_dir, f"{prefix}{key[:32]}.pickle")
+        if os.path.isfile(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    cached = _Unpickler(f).load()
+                # Unpickling complex JSON Paths imported jsonpath_ng
+                if cached['jsonpath_ng'] is None or cached['jsonpath_ng'] == _jsonpath().__version__:
+                    return cached['template']
+            except Exception as e:
+                logging.warning(f"[JSONConverter] Ignoring the template cache {cache_path}: {e}")
+
+        compiled = JSONConverter.__compile_template(template)
+        buffer = io.BytesIO()
+        # Only the parts of the template needing jsonpath_ng depend on its version
+        version = _jsonpath().__version__ if JSONConverter.__needs_jsonpath(compiled) else None
+        _Pickler(buffer, names).dump({'template': compiled, 'jsonpath_ng': version})
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(buffer.getvalue())
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logging.warning(f"[JSONConverter] Unable to write the template cache {cache_path}: {e}")
+            return compiled
+        if cache_name:
+            JSONConverter.__remove_stale(cache_dir, prefix, os.path.basename(cache_path))
+        return compiled
+
+    @staticmethod
+    def __remove_stale(cache_dir: str, prefix: str, current: str):
         '''
-        self._compiled_template = JSONConverter.__compile_template(template)
+            Remove the cache files of the previous versions of a template
+
+            Parameters:
+                cache_dir(str): directory of the cache files
+                prefix(str): prefix of the cache files of the template
+                current(str): name of the cache file of the current version
+        '''
+        try:
+            names = os.listdir(cache_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith(prefix) and name.endswith('.pickle') and name != current:
+                try:
+                    os.remove(os.path.join(cache_dir, name))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def __needs_jsonpath(compiled: any) -> bool:
+        if isinstance(compiled, _Path):
+            return compiled.fields is None
+        if isinstance(compiled, dict):
+            return any(JSONConverter.__needs_jsonpath(v) for v in compiled.values())
+        if isinstance(compiled, (list, tuple)):
+            return any(JSONConverter.__needs_jsonpath(v) for v in compiled)
+        return False
 
     @staticmethod
     def __is_call(t: any) -> bool:
@@ -46,33 +326,230 @@ class JSONConverter(object):
         return False
 
     @staticmethod
-    def __call(t: any, src) -> bool:
-        if callable(t):
-            return t()
-        # isinstance(t, tuple) and len(t) >= 2 and callable(t[0]) is True
-        fun = t[0]
-        args = tuple(JSONConverter.__convert(v, src) for v in t[1:])
-        return fun(*args)
+    def __simple_fields(path: 'jsonpath.JSONPath') -> tuple:
+        '''
+            Returns the field names of a path made only of Root and single Fields
+            children, such as $.a.b, or None if the path needs jsonpath_ng
+        '''
+        jsonpath = _jsonpath()
+        fields = []
+        while isinstance(path, jsonpath.Child):
+            right = path.right
+            if type(right) is not jsonpath.Fields or len(right.fields) != 1:
+                return None
+            field = right.fields[0]
+            if field == '*' or field == jsonpath.auto_id_field:
+                return None
+            fields.append(field)
+            path = path.left
+        if type(path) is not jsonpath.Root or not fields:
+            return None
+        return tuple(reversed(fields))
+
+    @staticmethod
+    def __build_fields(path: str, fields: tuple):
+        # Same lookups as jsonpath_ng Fields.find, without the match objects
+        def convert(src):
+            value = src
+            for field in fields:
+                try:
+                    value = value.get(field, _MISSING)
+                except (TypeError, AttributeError):
+                    value = _MISSING
+                if value is _MISSING:
+                    logging.warning(f"[JSONConverter] JSONPath '{path}' not found in source. Source: {src}")
+                    return None
+            return value
+
+        if len(fields) > 1:
+            return convert
+        field = fields[0]
+
+        def convert_field(src):
+            try:
+                value = src.get(field, _MISSING)
+            except (TypeError, AttributeError):
+                value = _MISSING
+            if value is _MISSING:
+                logging.warning(f"[JSONConverter] JSONPath '{path}' not found in source. Source: {src}")
+                return None
+            return value
+        return convert_field
+
+    @staticmethod
+    def __prune(value: any) -> any:
+        '''
+            Copy a value taken from the source or returned by a call,
+            without the None values of its dicts and lists
+        '''
+        if isinstance(value, dict):
+            return {k: JSONConverter.__prune(v) for (k, v) in value.items() if v is not None}
+        if isinstance(value, list):
+            return [JSONConverter.__prune(v) for v in value if v is not None]
+        return value
+
+    @staticmethod
+    def __build_pruned(convert):
+        prune = JSONConverter.__prune
+
+        def convert_pruned(src):
+            value = convert(src)
+            if isinstance(value, (dict, list)):
+                return prune(value)
+            return value
+        return convert_pruned
 
     @staticmethod
-    def __convert(template: any, src: dict) -> any:
-        if isinstance(template, jsonpath.JSONPath):
-            matches = template.find(src)
+    def __build_path(compiled: _Path, fast_paths: bool):
+        path = compiled.text
+        if fast_paths and compiled.fields is not None:
+            return JSONConverter.__build_fields(path, compiled.fields)
+        expression = compiled.expression()
+
+        def convert(src):
+            matches = expression.find(src)
             if not matches:
-                logging.warning(f"[JSONConverter] JSONPath '{template}' not found in source. Source: {src}")
+                logging.warning(f"[JSONConverter] JSONPath '{path}' not found in source. Source: {src}")
                 return None
             return matches[0].value
+        return convert
+
+    @staticmethod
+    def __build_call(t: any, fast_paths: bool):
+        if callable(t):
+            return lambda src: t()
+        # isinstance(t, tuple) and len(t) >= 2 and callable(t[0]) is True
+        fun = t[0]
+        # Arguments are passed as found, None values included
+        args = tuple(JSONConverter.__build(v, fast_paths, False) for v in t[1:])
+        if len(args) == 1:
+            arg = args[0]
+            return lambda src: fun(arg(src))
+        return lambda src: fun(*[arg(src) for arg in args])
+
+    @staticmethod
+    def __build(template: any, fast_paths: bool, omit_none: bool = False):
+        '''
+            Build the conversion function of a compiled template
+
+            The template shape is resolved once, the returned function
+            only evaluates JSON Paths and calls against the source
+
+            Parameters:
+                template(any): the compiled template
+                fast_paths(bool): lower plain field paths to dict lookups
+                omit_none(bool): skip the None values when building dicts and lists
+            Returns: a function converting a source dict according to template
+        '''
+        if isinstance(template, _Path):
+            convert = JSONConverter.__build_path(template, fast_paths)
+            return JSONConverter.__build_pruned(convert) if omit_none else convert
         if isinstance(template, str):
-            return template
+            return lambda src: template
+        if JSONConverter.__is_call(template):
+            convert = JSONConverter.__build_call(template, fast_paths)
+            return JSONConverter.__build_pruned(convert) if omit_none else convert
+        if isinstance(template, dict):
+            items = tuple((k, JSONConverter.__build(v, fast_paths, omit_none)) for (k, v) in template.items())
+            if not omit_none:
+                return lambda src: {k: convert(src) for (k, convert) in items}
+
+            def convert_dict(src):
+                output = {}
+                for (k, convert) in items:
+                    value = convert(src)
+                    if value is not None:
+                        output[k] = value
+                return output
+            return convert_dict
+        if isinstance(template, list):
+            elements = tuple(JSONConverter.__build(v, fast_paths, omit_none) for v in template)
+            if not omit_none:
+                return lambda src: [convert(src) for convert in elements]
+
+            def convert_list(src):
+                output = []
+                for convert in elements:
+                    value = convert(src)
+                    if value is not None:
+                        output.append(value)
+                return output
+            return convert_list
+        if template is None or isinstance(template, (bool, int, float)):
+            return lambda src: template
+        return lambda src: None
+
+    @staticmethod
+    def __build_path_columns(compiled: _Path, fast_paths: bool):
+        fields = compiled.fields if fast_paths else None
+        if fields is None:
+            convert = JSONConverter.__build_path(compiled, fast_paths)
+            return lambda batch: [convert(src) for src in batch.rows()]
+        path = compiled.text
+        first, rest = fields[0], fields[1:]
+
+        def convert_column(batch):
+            column = batch.columns.get(first)
+            if column is None:
+                logging.warning(f"[JSONConverter] JSONPath '{path}' not found in the source columns")
+                return [None] * batch.size
+            for field in rest:
+                column = [v.get(field) if isinstance(v, dict) else None for v in column]
+            return column
+        return convert_column
+
+    @staticmethod
+    def __build_call_columns(t: any, fast_paths: bool):
+        if callable(t):
+            return lambda batch: [t() for _ in range(batch.size)]
+        fun = t[0]
+        args = tuple(JSONConverter.__build_columns(v, fast_paths, False) for v in t[1:])
+        return lambda batch: list(map(fun, *[arg(batch) for arg in args]))
+
+    @staticmethod
+    def __build_pruned_columns(convert):
+        prune = JSONConverter.__prune
+        return lambda batch: [prune(v) if isinstance(v, (dict, list)) else v for v in convert(batch)]
+
+    @staticmethod
+    def __build_columns(template: any, fast_paths: bool, omit_none: bool = False):
+        '''
+            Build the conversion function of a compiled template for a batch of sources
+
+            Same output as __build for each source, the JSON Paths being resolved
+            to their column once and the calls mapped over whole columns
+
+            Parameters:
+                template(any): the compiled template
+                fast_paths(bool): lower plain field paths to column lookups
+                omit_none(bool): skip the None values when building dicts and lists
+            Returns: a function converting a _Batch to the list of its converted sources
+        '''
+        if isinstance(template, _Path):
+            convert = JSONConverter.__build_path_columns(template, fast_paths)
+            return JSONConverter.__build_pruned_columns(convert) if omit_none else convert
+        if isinstance(template, str) or template is None or isinstance(template, (bool, int, float)):
+            return lambda batch: [template] * batch.size
         if JSONConverter.__is_call(template):
-            return JSONConverter.__call(template, src)
+            convert = JSONConverter.__build_call_columns(template, fast_paths)
+            return JSONConverter.__build_pruned_columns(convert) if omit_none else convert
         if isinstance(template, dict):
-            ret = {k: JSONConverter.__convert(v, src) for (k, v) in template.items()}
-            return ret
+            keys = tuple(template)
+            converts = tuple(JSONConverter.__build_columns(v, fast_paths, omit_none) for v in template.values())
+            if not converts:
+                return lambda batch: [{} for _ in range(batch.size)]
+            if not omit_none:
+                return lambda batch: [dict(zip(keys, values)) for values in zip(*[c(batch) for c in converts])]
+            return lambda batch: [{k: v for (k, v) in zip(keys, values) if v is not None}
+                                  for values in zip(*[c(batch) for c in converts])]
         if isinstance(template, list):
-            ret = [JSONConverter.__convert(v, src) for v in template]
-            return ret
-        return None
+            converts = tuple(JSONConverter.__build_columns(v, fast_paths, omit_none) for v in template)
+            if not converts:
+                return lambda batch: [[] for _ in range(batch.size)]
+            if not omit_none:
+                return lambda batch: [list(values) for values in zip(*[c(batch) for c in converts])]
+            return lambda batch: [[v for v in values if v is not None] for values in zip(*[c(batch) for c in converts])]
+        return lambda batch: [None] * batch.size
 
     def filter(self, src: dict) -> bool:
         '''
@@ -94,5 +571,54 @@ class JSONConverter(object):
             Returns: a tuple containing (True, converted JSON) if converted, (False, src) if not
         '''
         if self.filter(src):
-            return (True, JSONConverter.__convert(self._compiled_template, src))
-        return (False, src)
\ No newline at end of file
+            return (True, self._convert(src))
+        return (False, src)
+
+    def convert_many(self, columns: dict, size: int = None) -> list:
+        '''
+            Convert a batch of JSON data given as columns
+
+            Each JSON Path of the template is resolved to its column once per batch,
+            and the calls are mapped over whole columns instead of row by row
+
+            Parameters:
+                columns(dict): the values of each field of the JSON data,
+                    as lists of the same length, None for a missing value
+                size(int): the number of JSON data, required if there is no column
+
+            Returns: the list of converted JSON, one per JSON data, the JSON data
+                that filter() rejects being returned as dicts
+        '''
+        if size is None:
+            if not columns:
+                raise ValueError("The number of rows of a batch without columns must be given")
+            size = len(next(iter(columns.values())))
+        if self._convert_columns is None:
+            self._convert_columns = JSONConverter.__build_columns(self._compiled_template, self._fast_paths, self._omit_none)
+        batch = _Batch(columns, size)
+        output = self._convert_columns(batch)
+        if type(self).filter is not JSONConverter.filter:
+            output = [converted if self.filter(src) else src for (converted, src) in zip(output, batch.rows())]
+        return output
+
+# Built-in functions of the templates, called with the values of their arguments
+
+@JSONConverter.register('capitalize_or_default')
+def capitalize_or_default(value, default=None):
+    return str(value).capitalize() if value else default
+
+@JSONConverter.register('first_non_empty')
+def first_non_empty(*values):
+    return next((v for v in values if v), None)
+
+@JSONConverter.register('if_else')
+def if_else(condition, value, otherwise=None):
+    return value if condition else otherwise
+
+@JSONConverter.register('lower')
+def lower(value):
+    return str(value).lower() if value is not None else None
+
+@JSONConverter.register('upper')
+def upper(value):
+    return str(value).upper() if value is not None else None
@@ -9,19 +9,28 @@ assigning, for example, the correct classification.
 
 import sys
 import os
-import traceback
-import uuid
-import requests
+import time
+import signal
+import threading
 import json
 import logging
-import logging.handlers
 from datetime import datetime, timezone
 from urllib.parse import urlparse
 
 # Inserts the "lib" directory in the path to find JSONConverter.py
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "lib"))
 
+# Every alert action starts a new interpreter: the heavy modules (requests, the JSONPath parser,
+# asyncio, the classifier) are imported on first use, so that a payload handed off to the
+# forwarder never loads them.
+
 def global_exception_hook(exc_type, exc_value, exc_traceback):
+    # Once the logger is set up the traceback goes through its queue, written before exiting
+    logger_obj = logging.getLogger("idmefv2_connector")
+    if logger_obj.handlers:
+        logger_obj.critical("Unhandled exception:", exc_info=(exc_type, exc_value, exc_traceback))
+        return
+    import traceback
     try:
         log_path = os.path.join(
             os.environ.get("SPLUNK_HOME", "."),
@@ -37,7 +46,10 @@ def global_exception_hook(exc_type, exc_value, exc_traceback):
 sys.excepthook = global_exception_hook
 
 try:
-    from JSONConverter import JSONConverter  # Ensures JSONConverter.py is in the correct path
+    import idmefv2_bulk
+    import idmefv2_logging
+    import idmefv2_metrics
+    import idmefv2_encoding
 except Exception as e:
     global_exception_hook(*sys.exc_info())
     sys.exit(1)
@@ -50,18 +62,78 @@ def get_current_datetime():
     current_datetime = datetime.utcnow()
     return current_datetime.strftime("%Y-%m-%dT%H:%M:%S.") + str(current_datetime.microsecond).zfill(6) + "Z"
 
-def send_to_idmefv2_endpoint(message, idmefv2_endpoint):
+_session = None
+
+def get_http_session(config):
+    """
+    Returns the HTTP session shared by every message sent by this process (or by the forwarder).
+    The connection pool size and keep-alive are read from the configuration that creates the session.
+    """
+    global _session
+    if _session is None:
+        pool_size = int(config_number(config, "pool_size", 4))
+        import requests
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not config_flag(config, "keep_alive", default=True):
+            session.headers["Connection"] = "close"
+        _session = session
+    return _session
+
+def get_http_timeout(config):
+    """
+    Returns the (connect, read) timeout in seconds of the requests to the endpoint.
+    """
+    return (config_number(config, "connect_timeout", 5.0), config_number(config, "read_timeout", 30.0))
+
+def get_compressor(config):
+    """
+    Returns the compressor of the request bodies of the alert configuration.
+    """
+    method = str(config.get("compression") or "none").strip().lower()
+    level = int(config_number(config, "compression_level", 0))
+    min_bytes = int(config_number(config, "compression_min_bytes", 1024))
+    try:
+        return idmefv2_encoding.Compressor(method, level, min_bytes)
+    except ValueError as e:
+        logger.warning("%s, sending uncompressed requests.", e)
+        return idmefv2_encoding.Compressor("none")
+
+def delivery_error(error):
+    """
+    Returns the DeliveryError of a requests exception, which is not retryable when the endpoint is misconfigured.
+    """
+    import requests
+    invalid = (requests.exceptions.MissingSchema, requests.exceptions.InvalidSchema, requests.exceptions.InvalidURL,
+               requests.exceptions.InvalidHeader, requests.exceptions.URLRequired)
+    return idmefv2_bulk.DeliveryError(str(error), retryable=not isinstance(error, invalid))
+
+def send_to_idmefv2_endpoint(message, idmefv2_endpoint, session=None, timeout=None, compressor=None):
+    import requests
     headers = {"Content-Type": "application/json"}
+    if session is None:
+        session = get_http_session({})
+    body = idmefv2_encoding.dumps(message)
+    if compressor is not None:
+        body, content_encoding = compressor.compress(body)
+        if content_encoding:
+            headers["Content-Encoding"] = content_encoding
     try:
-        response = requests.post(idmefv2_endpoint, headers=headers, data=json.dumps(message))
+        with metrics.stage("send"):
+            response = session.post(idmefv2_endpoint, headers=headers, data=body, timeout=timeout)
         if response.status_code == 200:
             return 200
         else:
-            raise Exception(f"API call returned status {response.status_code}: {response.text}")
+            raise idmefv2_bulk.DeliveryError.from_status(response.status_code, response.text)
     except requests.exceptions.RequestException as e:
-        raise Exception(e)
+        raise delivery_error(e)
 
 def setup_logger(level=logging.INFO):
+    """
+    Sets up the connector logger. Records are written to the log file by a background thread.
+    """
     logger_obj = logging.getLogger("idmefv2_connector")
     logger_obj.propagate = False
     logger_obj.setLevel(level)
@@ -69,58 +141,134 @@ def setup_logger(level=logging.INFO):
         os.environ.get("SPLUNK_HOME", "."),
         "var", "log", "splunk", "idmefv2_connector.log"
     )
-    file_handler = logging.handlers.RotatingFileHandler(
-        log_path, maxBytes=2500000000, backupCount=5
-    )
-    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-    file_handler.setFormatter(formatter)
-    logger_obj.addHandler(file_handler)
-    return logger_obj
+    return idmefv2_logging.start_logging(logger_obj, log_path, max_bytes=2500000000, backup_count=5)
 
 logger = setup_logger(logging.INFO)
 
+# Stage timers, emitted once per alert action or per interval in the forwarder
+metrics = idmefv2_metrics.Metrics()
+
+# Counters of each bulk or async sender at the last emit
+_sender_counts = {}
+
+def count_sender_deliveries():
+    """
+    Adds the messages sent, failed and spooled by the bulk and async senders since the last emit to the metrics,
+    and the request timings of the async sender, collected by its event loop thread.
+    Their batches are delivered in the background (linger time, event loop), after the payload was processed.
+    """
+    senders = list(_bulk_senders.values())
+    if _async_sender is not None:
+        senders.append(_async_sender)
+    for sender in senders:
+        counts = (sender.sent, sender.failed, sender.deferred)
+        last = _sender_counts.get(sender, (0, 0, 0))
+        metrics.count("sent", counts[0] - last[0])
+        metrics.count("failed", counts[1] - last[1])
+        metrics.count("spooled", counts[2] - last[2])
+        _sender_counts[sender] = counts
+    if _async_sender is not None:
+        metrics.stage("send_async").merge(_async_sender.take_timings())
+
+def emit_metrics(config, **dimensions):
+    """
+    Writes the stage timings to the metrics log, unless the "metrics_enabled" parameter is off.
+    """
+    count_sender_deliveries()
+    if config_flag(config, "metrics_enabled", default=True):
+        metrics.emit(idmefv2_metrics.metrics_logger(), **dimensions)
+    else:
+        metrics.reset()
+
+# Built-in keyword -> IDMEF classification, by decreasing priority,
+# used when default/idmefv2_classification.json cannot be loaded
+CLASSIFICATION_RULES = [
+    ("failed password", "Attempt.Login"),
+    ("accepted password", "Information.LoginSuccess"),
+    ("invalid user", "Information.UnauthorizedAccess"),
+    ("sudo", "Intrusion.AdminCompromise"),
+    ("brute force", "BruteForce-SSH"),
+    ("scan", "Recon.Scanning"),
+    ("malware", "Malicious.System"),
+    ("ddos", "Availability.DDoS"),
+]
+
+# Built-in keyword -> target service, by decreasing priority
+SERVICE_RULES = [
+    ("sshd", "SSH"),
+    ("httpd", "HTTP"),
+]
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Rule files by decreasing precedence, local/ rules extend and override the shipped ones
+CLASSIFICATION_FILES = [
+    os.path.join(APP_DIR, "local", "idmefv2_classification.json"),
+    os.path.join(APP_DIR, "default", "idmefv2_classification.json"),
+]
+CLASSIFICATION_CACHE = os.path.join(APP_DIR, "local", "cache", "idmefv2_classification.pickle")
+
+def load_classification_rules():
+    """
+    Loads the classification rule tables, compiled once so that each event is scanned in a single pass.
+    Falls back to the built-in rules if the rule files are missing or invalid.
+    """
+    import idmefv2_classifier
+    try:
+        rules = idmefv2_classifier.load_rules(CLASSIFICATION_FILES, CLASSIFICATION_CACHE)
+        if "category" in rules.tables and "service" in rules.tables:
+            return rules
+        logger.warning("No classification rules found in %s, using the built-in rules", CLASSIFICATION_FILES)
+    except Exception as e:
+        logger.error("Invalid classification rules, using the built-in rules: %s", e)
+    return idmefv2_classifier.RuleSet.from_definitions({
+        "category": {
+            "default": "Other.Undetermined",
+            "rules": [{"keyword": k, "value": v} for k, v in CLASSIFICATION_RULES],
+        },
+        "service": {
+            "default": "Unknown",
+            "rules": [{"keyword": k, "value": v} for k, v in SERVICE_RULES],
+        },
+    })
+
+_classification_rules = None
+
+def get_classification_rules():
+    """
+    Returns the classification rule tables, loaded on first use.
+    """
+    global _classification_rules
+    if _classification_rules is None:
+        _classification_rules = load_classification_rules()
+    return _classification_rules
+
+def extract_features(alert_data):
+    """
+    Scans the _raw field of the event once for every classification table.
+    Returns the feature record of the event, {"category": ..., "service": ...}.
+    """
+    return get_classification_rules().extract(alert_data.get("_raw", "").lower(), alert_data)
+
 def classify_event(alert_data):
     """
     Determins the IDMEF classification based on the event's message.
-    If alert_data is a dictionary, it utilizes the _raw field; if it is a string instead, it uses it directly.
+    If alert_data is a dictionary, it utilizes the _raw field and the field rules; if it is a string instead, it uses it directly.
     Returns the category in string format, for example "Attempt.Login" for failed logins.
     """
     if isinstance(alert_data, dict):
-        event_message = alert_data.get("_raw", "").lower()
-    else:
-        event_message = str(alert_data).lower()
-
-    mapping = {
-        "failed password": "Attempt.Login",
-        "accepted password": "Information.LoginSuccess",
-        "invalid user": "Information.UnauthorizedAccess",
-        "sudo": "Intrusion.AdminCompromise",
-        "brute force": "BruteForce-SSH",
-        "scan": "Recon.Scanning",
-        "malware": "Malicious.System",
-        "ddos": "Availability.DDoS",
-    }
-    for key, value in mapping.items():
-        if key in event_message:
-            return value
-    return "Other.Undetermined"
+        return get_classification_rules().evaluate("category", alert_data.get("_raw", "").lower(), alert_data)
+    return get_classification_rules().evaluate("category", str(alert_data).lower())
 
 def extract_service(alert_data):
     """
     Estracts the name of the service form the the _raw field.
-    If alert_data is a dictionary, it utilizes the _raw field; if it is a string instead, it uses it directly.
+    If alert_data is a dictionary, it utilizes the _raw field and the field rules; if it is a string instead, it uses it directly.
     Returns "SSH" when it finds "sshd", "HTTP" when it finds "httpd", "Unknown" otherwise.
     """
     if isinstance(alert_data, dict):
-        event_message = alert_data.get("_raw", "").lower()
-    else:
-        event_message = str(alert_data).lower()
-        
-    if "sshd" in event_message:
-        return "SSH"
-    elif "httpd" in event_message:
-        return "HTTP"
-    return "Unknown"
+        return get_classification_rules().evaluate("service", alert_data.get("_raw", "").lower(), alert_data)
+    return get_classification_rules().evaluate("service", str(alert_data).lower())
 
 def normalize_datetime(date_str):
     """
@@ -142,32 +290,49 @@ def normalize_datetime(date_str):
     
     return date_str
 
-def remove_none_fields(obj):
-    if isinstance(obj, dict):
-        return {k: remove_none_fields(v) for k, v in obj.items() if v is not None}
-    elif isinstance(obj, list):
-        return [remove_none_fields(i) for i in obj if i is not None]
-    else:
-        return obj
+def template_analyzer_ip(url):
+    return extract_ip_from_url(url) if url else "0.0.0.0"
+
+# Functions of the connector called by the template, besides the JSONConverter built-in ones
+TEMPLATE_FUNCTIONS = {
+    "current_datetime": get_current_datetime,
+    "analyzer_ip": template_analyzer_ip,
+}
+
+# Template files by decreasing precedence, the first one found is used
+TEMPLATE_FILES = [
+    os.path.join(APP_DIR, "local", "idmefv2_template.json"),
+    os.path.join(APP_DIR, "local", "idmefv2_template.yaml"),
+    os.path.join(APP_DIR, "default", "idmefv2_template.json"),
+]
+TEMPLATE_CACHE_DIR = os.path.join(APP_DIR, "local", "cache")
 
-# Updated template: the JSONPath are relative to the unified object we pass to the converter.
+# Route files by decreasing precedence, the templates of the routes are looked up in the same directories
+TEMPLATE_DIRS = [
+    os.path.join(APP_DIR, "local"),
+    os.path.join(APP_DIR, "default"),
+]
+TEMPLATE_ROUTES_FILES = [os.path.join(directory, "idmefv2_template_routes.json") for directory in TEMPLATE_DIRS]
+
+# Built-in template, used if the template files are missing or invalid.
+# The JSONPath are relative to the unified object we pass to the converter.
 template = {
     "Version": "2.D.V04",
-    "ID": "$.sid",
+    "ID": "$.idmef_id",
     "OrganisationName": "ElmiSoftware",
     "OrganizationId": "de0fdb525074492eabbf51d1842e43b8",
     "Description": "$.description",
-    "Priority": (lambda urgency: str(urgency).capitalize() if urgency else "Medium", "$.urgency"),
-    "CreateTime": lambda: get_current_datetime(),
+    "Priority": {"$fn": "capitalize_or_default", "args": ["$.urgency", "Medium"]},
+    "CreateTime": {"$fn": "current_datetime"},
     "StartTime": "$.StartTime",
-    "Category": (lambda data: [classify_event(data)] if data else ["Unclassified"], "$._raw"),
+    "Category": {"$fn": "if_else", "args": ["$._raw", ["$.idmef_category"], ["Unclassified"]]},
     "Analyzer": {
         "Name": "$.dvc_name",
         "Hostname": "$.dvc_host",
         "Type": "$.category",
         "Model": "Splunk Enterprise",
         "Category": ["SIEM"],
-        "IP": (lambda url: extract_ip_from_url(url) if url else "0.0.0.0", "$.server_uri")
+        "IP": {"$fn": "analyzer_ip", "args": ["$.server_uri"]}
     },
     "Source": [{
         "IP": "$.src_ip",
@@ -179,102 +344,624 @@ template = {
         "Unlocation": "$.src_country",
     }],
     "Target": [{
-        "Service": (
-            lambda *args: next((v for v in args if v), "unknown_service"),
-            "$.service", "$.process", "$.process_name"
-        ),
+        "Service": {"$fn": "first_non_empty", "args": ["$.service", "$.process", "$.process_name", "unknown_service"]},
         "Port": "$.dest_port",
         "Unlocation": "$.dest_country"
     }]
 }
 
+def register_template_functions():
+    """
+    Registers the connector functions called by the templates in the JSONConverter registry.
+    """
+    from JSONConverter import JSONConverter
+    for name, function in TEMPLATE_FUNCTIONS.items():
+        JSONConverter.register(name, function)
+    return JSONConverter
+
+def load_converter():
+    """
+    Compiles the template of the first template file found, or the built-in template if there is none
+    or it is invalid. The compiled templates are cached under local/cache, a new process loads them instead
+    of parsing the JSONPaths.
+    When template routes are defined, returns a router converting each result with the template of its
+    search, app or sourcetype, the template above being the default one.
+    """
+    JSONConverter = register_template_functions()
+
+    def build(definition, name):
+        # Null fields are left out while converting, the message needs no cleanup pass
+        return JSONConverter(definition, omit_none=True, cache_dir=TEMPLATE_CACHE_DIR, cache_name=name)
+
+    converter = None
+    for path in TEMPLATE_FILES:
+        if not os.path.isfile(path):
+            continue
+        try:
+            converter = build(JSONConverter.load_template(path), path)
+        except Exception as e:
+            logger.error("Invalid template %s, using the built-in template: %s", path, e)
+        break
+    if converter is None:
+        converter = build(template, "<built-in>")
+
+    import idmefv2_router
+    try:
+        return idmefv2_router.load_router(TEMPLATE_ROUTES_FILES, TEMPLATE_DIRS, build, converter)
+    except Exception as e:
+        logger.error("Invalid template routes, using a single template: %s", e)
+        return converter
+
+def config_flag(config, name, default=False):
+    """
+    Reads a boolean alert action parameter.
+    Splunk passes every parameter as a string, so "1", "true", "yes" and "on" are considered enabled.
+    """
+    value = config.get(name)
+    if value is None or value == "":
+        return default
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+def config_number(config, name, default):
+    """
+    Reads a numeric alert action parameter, returning the default when it is missing or invalid.
+    """
+    value = config.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return type(default)(value)
+    except ValueError:
+        logger.warning("Invalid value '%s' for '%s', defaulting to '%s'", value, name, default)
+        return default
+
+def read_results_file(results_file):
+    """
+    Streams the rows of the gzipped CSV results file written by Splunk for the fired alert.
+    Each row is yielded as a dictionary; empty values and the "__mv_" multivalue helper columns are skipped,
+    so that rows look like the "result" field of the payload.
+    """
+    import csv
+    import gzip
+    csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+    with gzip.open(results_file, "rt", newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            yield {k: v for k, v in row.items() if v != "" and k and not k.startswith("__mv_")}
+
+def iter_results(payload, batch_mode):
+    """
+    Returns an iterator over the results to convert.
+    In batch mode every row of the payload's "results_file" is returned, otherwise only the "result" field.
+    """
+    results_file = payload.get("results_file")
+    if batch_mode and results_file and os.path.isfile(results_file):
+        logger.info("Batch mode: reading results from %s", results_file)
+        return read_results_file(results_file)
+    if batch_mode:
+        logger.warning("Results file '%s' not available, converting only the 'result' field.", results_file)
+    return iter([payload.get("result", {})])
+
+def get_payload_logger(config):
+    """
+    Returns the logger of the payloads, results and IDMEFv2 messages for the alert configuration.
+    """
+    return idmefv2_logging.PayloadLogger(
+        str(config.get("payload_log_level") or "DEBUG").strip().upper(),
+        config_number(config, "payload_log_max_chars", 4096),
+        config_number(config, "payload_log_sample_rate", 1.0),
+    )
+
+def prepare_result(payload, config, result_data, payload_log=None):
+    """
+    Unifies a single result with the higher level payload fields and sets the dynamic and default values.
+    The result is logged before and after if a payload logger is given.
+    """
+    if payload_log is not None:
+        payload_log.payload("Received result: %s", result_data)
+
+    # Set defaults
+    result_data["_raw"] = result_data.get("_raw", "")
+    # The template reads the features back instead of scanning _raw again
+    with metrics.stage("classify"):
+        features = extract_features(result_data)
+    result_data["idmef_category"] = features["category"]
+    result_data["target_service"] = features["service"]
+
+    # Merge configuration and other top-level payload fields. They describe the alert and take precedence:
+    # the template and the template routes read the sid, server_uri, app and search_name of the alert,
+    # while results often have an unrelated "app" field (e.g. the CIM application protocol)
+    result_data["configuration"] = config
+    for key, value in payload.items():
+        if key != "result":
+            result_data[key] = value
+    # Every result of an alert shares its sid, each IDMEFv2 message gets its own ID
+    import uuid
+    result_data["idmef_id"] = str(uuid.uuid4())
+
+    # Set required default fields if missing
+    required_fields = {
+        "sid": "unknown",
+        "server_uri": "unknown",
+        "ip": "0.0.0.0",
+        "user": "unknown",
+        "host": "unknown",
+        "port": 0
+    }
+    for field, default in required_fields.items():
+        if field not in result_data or not result_data[field]:
+            logger.warning("Missing field '%s', defaulting to '%s'", field, default)
+            result_data[field] = default
+
+    # Normalize datetime fields
+    if "start_time" in result_data:
+        normalized = normalize_datetime(result_data["start_time"])
+        result_data["StartTime"] = normalized
+        logger.info("Normalized 'start_time' to 'StartTime': %s", normalized)
+    result_data["CreateTime"] = get_current_datetime()
+
+    if payload_log is not None:
+        payload_log.payload("Final result_data before conversion: %s", result_data)
+    return result_data
+
+def convert_result(converter, result_data, payload_log=None):
+    """
+    Converts a prepared result into the IDMEFv2 format.
+    The message is logged if a payload logger is given.
+    """
+    # Convert to IDMEFv2
+    try:
+        converted, idmef_message = converter.convert(result_data)
+    except Exception as conv_err:
+        logger.error("Conversion error: %s", conv_err, exc_info=True)
+        raise
+
+    if not converted:
+        raise Exception("IDMEF conversion failed.")
+
+    if payload_log is not None:
+        payload_log.payload("Generated IDMEF message: %s", idmef_message)
+    return idmef_message
+
+def send_idmef_message(idmef_message, idmefv2_endpoint, session=None, timeout=None, compressor=None):
+    """
+    Sends an IDMEFv2 message to the endpoint.
+    """
+    result = send_to_idmefv2_endpoint(idmef_message, idmefv2_endpoint, session, timeout, compressor)
+    if result == 200:
+        logger.info("Alert has been sent to IDMEFv2 Server.")
+    else:
+        raise Exception("Alert not sent properly.")
+
+def convert_and_send(converter, result_data, idmefv2_endpoint, session=None, timeout=None, compressor=None):
+    """
+    Converts a prepared result into the IDMEFv2 format and sends it to the endpoint.
+    """
+    send_idmef_message(convert_result(converter, result_data), idmefv2_endpoint, session, timeout, compressor)
+
+# Prepared results converted together, column by column
+CONVERT_CHUNK_SIZE = 512
+
+def convert_chunk(converter, payload, config, results, payload_log=None):
+    """
+    Prepares a chunk of results and converts them with a single convert_many() call over their columns.
+    Returns the IDMEFv2 message of each result, or the exception that prevented its conversion.
+    Falls back to converting the results one by one if the chunk can't be converted.
+    """
+    outcomes = [None] * len(results)
+    prepared = []
+    for i, result_data in enumerate(results):
+        # Every record of a sampled result is logged, nothing is serialized for the others
+        result_log = payload_log if payload_log is not None and payload_log.enabled() else None
+        try:
+            with metrics.stage("prepare"):
+                prepared.append((i, prepare_result(payload, config, result_data, result_log), result_log))
+        except Exception as e:
+            outcomes[i] = e
+    if not prepared:
+        return outcomes
+
+    with metrics.stage("convert"):
+        try:
+            # The results don't all have the same fields, a missing one is None in its column
+            names = dict.fromkeys(name for _, result_data, _ in prepared for name in result_data)
+            columns = {name: [result_data.get(name) for _, result_data, _ in prepared] for name in names}
+            messages = converter.convert_many(columns, len(prepared))
+        except Exception as e:
+            logger.warning("Converting %d results at once failed, converting them one by one: %s", len(prepared), e)
+            messages = None
+    for n, (i, result_data, result_log) in enumerate(prepared):
+        if messages is None:
+            try:
+                outcomes[i] = convert_result(converter, result_data, result_log)
+            except Exception as e:
+                outcomes[i] = e
+            continue
+        outcomes[i] = messages[n]
+        if result_log is not None:
+            result_log.payload("Generated IDMEF message: %s", messages[n])
+    return outcomes
+
+def iter_messages(converter, payload, config, results, payload_log=None):
+    """
+    Prepares and converts the results by chunks of CONVERT_CHUNK_SIZE.
+    Yields the IDMEFv2 message of each result, or the exception that prevented its conversion.
+    """
+    chunk = []
+    for result_data in results:
+        chunk.append(result_data)
+        if len(chunk) >= CONVERT_CHUNK_SIZE:
+            yield from convert_chunk(converter, payload, config, chunk, payload_log)
+            chunk = []
+    if chunk:
+        yield from convert_chunk(converter, payload, config, chunk, payload_log)
+
+_converter = None
+
+def get_converter():
+    """
+    Returns the JSONConverter of the template, compiled once per process.
+    """
+    global _converter
+    if _converter is None:
+        _converter = load_converter()
+    return _converter
+
+_spool = None
+
+def get_spool(config):
+    """
+    Returns the spool of undelivered messages, or None when the "spool_enabled" parameter is off.
+    """
+    global _spool
+    if not config_flag(config, "spool_enabled", default=True):
+        return None
+    if _spool is None:
+        import idmefv2_spool
+        _spool = idmefv2_spool.Spool(max_bytes=int(config_number(config, "spool_max_bytes", 268435456)))
+    return _spool
+
+def spool_undelivered(spool, idmefv2_endpoint, messages, error):
+    """
+    Spools messages whose delivery failed for a retryable reason. Returns True if they were spooled.
+    """
+    if spool is None or not getattr(error, "retryable", True):
+        return False
+    try:
+        spool.append(idmefv2_endpoint, messages)
+        spool.record_failure(idmefv2_endpoint)
+        return True
+    except OSError as e:
+        logger.error("Unable to spool %d messages: %s", len(messages), e)
+        return False
+
+def drain_spool(config):
+    """
+    Replays the spooled messages, as bulk requests when the "bulk_format" parameter is set.
+    Rejected messages are dropped, the drain of an endpoint stops at its first retryable failure.
+    """
+    spool = get_spool(config)
+    if spool is None or not spool.pending():
+        return 0
+    session = get_http_session(config)
+    timeout = get_http_timeout(config)
+    compressor = get_compressor(config)
+    fmt = str(config.get("bulk_format") or "none").strip().lower()
+
+    def send(idmefv2_endpoint, messages):
+        if fmt == "none":
+            for message in messages:
+                try:
+                    send_to_idmefv2_endpoint(message, idmefv2_endpoint, session, timeout, compressor)
+                except idmefv2_bulk.DeliveryError as e:
+                    if e.retryable:
+                        raise
+                    logger.error("Spooled message rejected by the endpoint, dropped: %s", e)
+            return
+        errors = []
+
+        def rejected(failed, error):
+            # Rejected messages are taken over (dropped), the others are left in the spool
+            errors.append(error)
+            if error.retryable:
+                return False
+            logger.error("%d spooled messages rejected by the endpoint, dropped: %s", len(failed), error)
+            return True
+
+        post = bulk_post(session, idmefv2_endpoint, timeout, compressor)
+        bulk = idmefv2_bulk.BulkSender(post, fmt, max_messages=len(messages),
+                                       max_bytes=int(config_number(config, "bulk_max_bytes", 4194304)),
+                                       on_failure=rejected)
+        for message in messages:
+            bulk.add(message)
+        bulk.flush()
+        retryable = [e for e in errors if e.retryable]
+        if retryable:
+            raise retryable[0]
+
+    return spool.drain(send, batch_size=int(config_number(config, "bulk_max_messages", 500)))
+
+def bulk_post(session, idmefv2_endpoint, timeout, compressor):
+    """
+    Returns the post(body, content_type) function of a bulk sender, which returns the HTTP status.
+    """
+    import requests
+
+    def post(body, content_type):
+        headers = {"Content-Type": content_type}
+        body, content_encoding = compressor.compress(body)
+        if content_encoding:
+            headers["Content-Encoding"] = content_encoding
+        try:
+            with metrics.stage("send_bulk"):
+                response = session.post(idmefv2_endpoint, headers=headers, data=body, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            raise delivery_error(e)
+        return response.status_code
+    return post
+
+_bulk_senders = {}
+
+def get_bulk_sender(config, idmefv2_endpoint):
+    """
+    Returns the bulk sender of the endpoint, or None when the "bulk_format" parameter is "none".
+    Senders are created once per endpoint and format, with the batching limits of the creating configuration.
+    """
+    fmt = str(config.get("bulk_format") or "none").strip().lower()
+    if fmt == "none":
+        return None
+    key = (idmefv2_endpoint, fmt)
+    if key not in _bulk_senders:
+        session = get_http_session(config)
+        timeout = get_http_timeout(config)
+        spool = get_spool(config)
+        _bulk_senders[key] = idmefv2_bulk.BulkSender(
+            bulk_post(session, idmefv2_endpoint, timeout, get_compressor(config)), fmt,
+            max_messages=int(config_number(config, "bulk_max_messages", 500)),
+            max_bytes=int(config_number(config, "bulk_max_bytes", 4194304)),
+            linger=config_number(config, "bulk_linger", 1.0),
+            on_failure=lambda messages, error: spool_undelivered(spool, idmefv2_endpoint, messages, error)
+        )
+    return _bulk_senders[key]
+
+_async_sender = None
+
+def get_async_sender(config):
+    """
+    Returns the asyncio delivery engine when the "delivery_mode" parameter is "async", None otherwise.
+    It is started once per process, with the concurrency limits of the creating configuration.
+    """
+    global _async_sender
+    if str(config.get("delivery_mode") or "sync").strip().lower() != "async":
+        return None
+    if _async_sender is None:
+        import idmefv2_async
+        spool = get_spool(config)
+        connect_timeout, read_timeout = get_http_timeout(config)
+        _async_sender = idmefv2_async.AsyncSender(
+            concurrency=int(config_number(config, "async_concurrency", 8)),
+            endpoint_concurrency=int(config_number(config, "async_endpoint_concurrency", 8)),
+            queue_size=int(config_number(config, "async_queue_size", 1000)),
+            fmt=str(config.get("bulk_format") or "none").strip().lower(),
+            max_messages=int(config_number(config, "bulk_max_messages", 500)),
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            on_failure=lambda endpoint, messages, error: spool_undelivered(spool, endpoint, messages, error),
+            compressor=get_compressor(config)
+        ).start()
+    return _async_sender
+
+def flush_bulk_senders(expired_only=False):
+    """
+    Sends the pending bulk batches, or only those that waited for their linger time.
+    """
+    for bulk in list(_bulk_senders.values()):
+        if expired_only:
+            bulk.flush_if_expired()
+        else:
+            bulk.flush()
+    if _async_sender is not None:
+        _async_sender.flush()
+
+def process_payload(payload, idmefv2_endpoint=None, flush=True):
+    """
+    Converts the results of an alert payload and sends them to the IDMEFv2 endpoint.
+    The endpoint of the alert configuration is used unless one is given.
+    In bulk mode, flush=False leaves the last batch pending until its linger time (forwarder).
+    Messages that can't be delivered, or all of them while the endpoint is backing off, are spooled.
+    """
+    config = payload.get("configuration", {})
+    payload_log = get_payload_logger(config)
+    if payload_log.enabled():
+        payload_log.payload("Received payload: %s", payload)
+    if idmefv2_endpoint is None:
+        idmefv2_endpoint = config.get("idmefv2_endpoint", "http://default-endpoint")
+    batch_mode = config_flag(config, "batch_mode", default=False)
+    logger.info("Using generic Splunk template with dynamic classification.")
+
+    # The template is compiled once and the connections are kept alive for every result
+    converter = get_converter()
+    session = get_http_session(config)
+    timeout = get_http_timeout(config)
+    compressor = get_compressor(config)
+    # The asynchronous engine groups the bulk requests itself
+    sender = get_async_sender(config)
+    bulk = get_bulk_sender(config, idmefv2_endpoint) if sender is None else None
+    if sender is None:
+        sender = bulk
+    if sender is not None:
+        sender_sent, sender_failed, sender_deferred = sender.sent, sender.failed, sender.deferred
+    spool = get_spool(config)
+    deferring = spool is not None and spool.backing_off(idmefv2_endpoint)
+    if deferring:
+        logger.warning("IDMEFv2 endpoint unavailable, spooling the messages for a later retry.")
+
+    sent = 0
+    failed = 0
+    spooled = 0
+    queued = 0
+    # Deferred messages are spooled in chunks, to batch the fsyncs
+    deferred = []
+    for idmef_message in iter_messages(converter, payload, config, iter_results(payload, batch_mode), payload_log):
+        try:
+            if isinstance(idmef_message, Exception):
+                raise idmef_message
+            if deferring:
+                deferred.append(idmef_message)
+                if len(deferred) >= spool.fsync_every:
+                    spool.append(idmefv2_endpoint, deferred)
+                    spooled += len(deferred)
+                    deferred = []
+            elif bulk is not None:
+                bulk.add(idmef_message)
+                queued += 1
+            elif sender is not None:
+                sender.submit(idmefv2_endpoint, idmef_message)
+                queued += 1
+            else:
+                try:
+                    send_idmef_message(idmef_message, idmefv2_endpoint, session, timeout, compressor)
+                    sent += 1
+                except idmefv2_bulk.DeliveryError as e:
+                    if not spool_undelivered(spool, idmefv2_endpoint, [idmef_message], e):
+                        raise
+                    spooled += 1
+                    # The endpoint is unavailable, don't wait for it on every remaining result
+                    deferring = True
+        except Exception as e:
+            if not batch_mode:
+                raise
+            failed += 1
+            logger.error("Result %d not sent: %s", sent + failed, e, exc_info=True)
+
+    if deferred:
+        spool.append(idmefv2_endpoint, deferred)
+        spooled += len(deferred)
+
+    # The deliveries of the senders are counted when the metrics are emitted
+    metrics.count("sent", sent)
+    metrics.count("spooled", spooled)
+    metrics.count("failed", failed)
+
+    if sender is not None:
+        if flush and sender is bulk:
+            bulk.flush()
+        elif flush:
+            sender.join()
+        if flush:
+            sent += sender.sent - sender_sent
+            failed += sender.failed - sender_failed
+            spooled += sender.deferred - sender_deferred
+            queued = 0
+
+    if flush and not deferring:
+        drain_spool(config)
+
+    if batch_mode and queued:
+        logger.info("Batch processed: %d alerts sent, %d queued for delivery, %d spooled, %d failed.",
+                    sent, queued, spooled, failed)
+    elif batch_mode:
+        logger.info("Batch completed: %d alerts sent, %d spooled, %d failed.", sent, spooled, failed)
+    if failed:
+        raise Exception(f"{failed} of {sent + failed} alerts not sent properly.")
+
+def hand_off_to_forwarder(raw_payload, config):
+    """
+    Writes the raw payload to the local forwarder when it is enabled in the alert configuration.
+    Returns True if the forwarder took the payload over.
+    """
+    if not config_flag(config, "use_forwarder"):
+        return False
+    import idmefv2_forwarder
+    socket_path = config.get("forwarder_socket") or idmefv2_forwarder.DEFAULT_SOCKET_PATH
+    if idmefv2_forwarder.hand_off(raw_payload.encode("utf-8"), socket_path):
+        logger.info("Payload handed off to the forwarder on %s.", socket_path)
+        return True
+    logger.warning("Forwarder not available on %s, processing the payload in this process.", socket_path)
+    return False
+
+def run_forwarder(args):
+    """
+    Runs the long-lived forwarder, which processes the payloads handed off by the alert actions.
+    """
+    import argparse
+    import idmefv2_forwarder
+    parser = argparse.ArgumentParser(prog="idmefv2-connector.py --forwarder")
+    parser.add_argument("--socket", default=idmefv2_forwarder.DEFAULT_SOCKET_PATH, help="Unix socket to listen on")
+    parser.add_argument("--endpoint", help="IDMEFv2 endpoint overriding the alert configuration, e.g. a local stub for testing")
+    parser.add_argument("--queue-size", type=int, default=1000, help="payloads queued before the next ones are refused")
+    parser.add_argument("--metrics-interval", type=float, default=60.0, help="seconds between two metrics records")
+    options = parser.parse_args(args)
+
+    # Configuration of the latest payload, used to drain the spool
+    last_config = []
+
+    next_metrics = [time.monotonic() + options.metrics_interval]
+
+    def process(data):
+        with metrics.stage("parse"):
+            payload = json.loads(data)
+        last_config[:] = [payload.get("configuration", {})]
+        with metrics.stage("total"):
+            process_payload(payload, options.endpoint, flush=False)
+
+    def tick():
+        flush_bulk_senders(expired_only=True)
+        if last_config:
+            drain_spool(last_config[-1])
+        if options.metrics_interval > 0 and time.monotonic() >= next_metrics[0]:
+            next_metrics[0] = time.monotonic() + options.metrics_interval
+            emit_metrics(last_config[-1] if last_config else {}, mode="forwarder")
+
+    try:
+        forwarder = idmefv2_forwarder.Forwarder(process, options.socket, options.queue_size, tick=tick)
+    except idmefv2_forwarder.ForwarderRunning as e:
+        logger.info("%s, exiting.", e)
+        return
+
+    get_converter()
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=forwarder.shutdown).start())
+    try:
+        forwarder.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        flush_bulk_senders()
+        if _async_sender is not None:
+            _async_sender.close()
+        emit_metrics(last_config[-1] if last_config else {}, mode="forwarder")
+
 def main():
     """
     Main functionalities:
     - Reading the payload from stdin.
-    - Unifying the higher level data (payload) with the "result" field's content.
+    - Handing the payload off to the local forwarder, when enabled and running.
+    - Streaming every row of the results file in batch mode, or only the "result" field otherwise.
+    - Unifying the higher level data (payload) with each result's content.
     - Verifying the presence of the mandatory fields and setting them as default values if they aren't present.
     - Calculating the dynamic classification and pre-calculating the target service.
     - Normalizing date fields.
     - Converting the message into the IDMEFv2 format using JSONConverter.
     - Sending the message to the specified IDMEFv2 endpoint.
+    With --forwarder, runs the forwarder daemon instead.
     """
     try:
         if len(sys.argv) > 1 and sys.argv[1] == "--execute":
-            payload = json.loads(sys.stdin.read())
-            logger.info("Received payload: %s", json.dumps(payload, indent=4))
-            
+            raw_payload = sys.stdin.read()
+            with metrics.stage("parse"):
+                payload = json.loads(raw_payload)
             config = payload.get("configuration", {})
-            idmefv2_endpoint = config.get("idmefv2_endpoint", "http://default-endpoint")
-            logger.info("Using generic Splunk template with dynamic classification.")
-            
-            result_data = payload.get("result", {})
-            logger.info("Received result: %s", json.dumps(result_data, indent=4))
-            
-            # Set defaults
-            result_data["_raw"] = result_data.get("_raw", "")
-            result_data["idmef_category"] = classify_event(result_data)
-            
-            try:
-                result_data["target_service"] = extract_service(result_data)
-            except Exception as e:
-                logger.warning("Unable to extract target service: %s. Defaulting to 'Unknown'.", e)
-                result_data["target_service"] = "Unknown"
-            
-            # Merge configuration and other top-level payload fields
-            result_data["configuration"] = config
-            for key, value in payload.items():
-                if key != "result":
-                    result_data[key] = value
-            
-            # Set required default fields if missing
-            required_fields = {
-                "sid": "unknown",
-                "server_uri": "unknown",
-                "ip": "0.0.0.0",
-                "user": "unknown",
-                "host": "unknown",
-                "port": 0
-            }
-            for field, default in required_fields.items():
-                if field not in result_data or not result_data[field]:
-                    logger.warning("Missing field '%s', defaulting to '%s'", field, default)
-                    result_data[field] = default
-
-            # Normalize datetime fields
-            if "start_time" in result_data:
-                normalized = normalize_datetime(result_data["start_time"])
-                result_data["StartTime"] = normalized
-                logger.info("Normalized 'start_time' to 'StartTime': %s", normalized)
-            result_data["CreateTime"] = get_current_datetime()
-
-            logger.info("Final result_data before conversion: %s", json.dumps(result_data, indent=4))
-            
-            # Convert to IDMEFv2
             try:
-                converter = JSONConverter(template)
-                converted, idmef_message = converter.convert(result_data)
-            except Exception as conv_err:
-                logger.error("Conversion error: %s", conv_err, exc_info=True)
-                raise
-            
-            if not converted:
-                raise Exception("IDMEF conversion failed.")
-
-            # Clean null fields
-            idmef_message = remove_none_fields(idmef_message)
-
-            logger.info("Generated IDMEF message: %s", json.dumps(idmef_message, indent=4))
-            
-            # Send
-            result = send_to_idmefv2_endpoint(idmef_message, idmefv2_endpoint)
-            if result == 200:
-                logger.info("Alert has been sent to IDMEFv2 Server.")
-            else:
-                raise Exception("Alert not sent properly.")
+                if hand_off_to_forwarder(raw_payload, config):
+                    return
+                with metrics.stage("total"):
+                    process_payload(payload)
+            finally:
+                emit_metrics(config, mode="alert", search_name=payload.get("search_name"), sid=payload.get("sid"))
+        elif len(sys.argv) > 1 and sys.argv[1] == "--forwarder":
+            run_forwarder(sys.argv[2:])
     except Exception as e:
         logger.error("Error occurred: %s", str(e), exc_info=True)
         raise
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,307 @@
+"""
+Asynchronous delivery engine for IDMEFv2 messages.
+
+An asyncio event loop running in a background thread keeps several requests in flight to the endpoints,
+using a minimal HTTP/1.1 client built on the standard library with keep-alive connections.
+Messages are submitted from the converting thread through a bounded queue, which blocks the
+producer when the endpoints can't keep up.
+"""
+
+import ssl
+import time
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import idmefv2_bulk
+import idmefv2_encoding
+import idmefv2_metrics
+
+logger = logging.getLogger("idmefv2_connector")
+
+class HTTPConnection:
+    """
+    Keep-alive HTTP/1.1 connection to an endpoint.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.reusable = True
+
+    @classmethod
+    async def open(cls, endpoint, timeout):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(endpoint.host, endpoint.port, ssl=endpoint.ssl_context,
+                                    server_hostname=endpoint.host if endpoint.ssl_context else None),
+            timeout)
+        return cls(reader, writer)
+
+    async def post(self, endpoint, body, content_type, timeout, content_encoding=None):
+        """
+        Sends a POST request, returns the response status.
+        """
+        head = (f"POST {endpoint.target} HTTP/1.1\r\n"
+                f"Host: {endpoint.netloc}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                + (f"Content-Encoding: {content_encoding}\r\n" if content_encoding else "")
+                + f"Content-Length: {len(body)}\r\n"
+                "Connection: keep-alive\r\n\r\n")
+        self.writer.write(head.encode("latin-1") + body)
+        await self.writer.drain()
+        return await asyncio.wait_for(self.read_response(), timeout)
+
+    async def read_head(self):
+        """
+        Reads the status line and the headers of a response, returns (version, status, headers).
+        """
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by the endpoint")
+        version, status = status_line.split(None, 2)[:2]
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return version, int(status), headers
+
+    async def read_response(self, method="POST"):
+        """
+        Reads a response and skips its body, returns the status.
+        1xx, 204 and 304 responses and the responses to HEAD have no body, the others are delimited
+        by chunked encoding, Content-Length or, when the endpoint closes the connection, its end.
+        """
+        version, status, headers = await self.read_head()
+        # Interim responses (e.g. 103 Early Hints) come before the final one
+        while 100 <= status < 200:
+            version, status, headers = await self.read_head()
+        connection = headers.get("connection", "").lower()
+        closing = connection == "close" or (version == b"HTTP/1.0" and connection != "keep-alive")
+
+        if method == "HEAD" or status in (204, 304):
+            pass
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    break
+                await self.reader.readexactly(size + 2)
+            # Trailer fields, up to the empty line
+            while (await self.reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+        elif "content-length" in headers:
+            await self.reader.readexactly(int(headers["content-length"]))
+        elif closing:
+            await self.reader.read()
+        else:
+            # The body would only end with the connection, which a keep-alive endpoint doesn't close
+            closing = True
+        if closing:
+            self.reusable = False
+        return status
+
+    def close(self):
+        self.reusable = False
+        self.writer.close()
+
+class Endpoint:
+    """
+    Pool of connections to an endpoint, with at most `concurrency` requests in flight.
+    """
+
+    def __init__(self, url, concurrency):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported endpoint scheme '{parts.scheme}'")
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.netloc = parts.netloc.rpartition("@")[2]
+        self.target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self.ssl_context = ssl.create_default_context() if parts.scheme == "https" else None
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.idle = []
+
+    async def post(self, body, content_type, connect_timeout, read_timeout, content_encoding=None):
+        async with self.semaphore:
+            reused = bool(self.idle)
+            connection = self.idle.pop() if reused else await HTTPConnection.open(self, connect_timeout)
+            try:
+                status = await connection.post(self, body, content_type, read_timeout, content_encoding)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                connection.close()
+                if not reused:
+                    raise
+                # The endpoint closed the idle connection, retry once on a new one
+                logger.debug("Keep-alive connection lost (%s), reconnecting.", e)
+                connection = await HTTPConnection.open(self, connect_timeout)
+                status = await connection.post(self, body, content_type, read_timeout, content_encoding)
+            except BaseException:
+                connection.close()
+                raise
+            if connection.reusable:
+                self.idle.append(connection)
+            else:
+                connection.close()
+            return status
+
+    def close(self):
+        while self.idle:
+            self.idle.pop().close()
+
+class AsyncSender:
+    """
+    Sends messages with up to `concurrency` requests in flight, and at most `endpoint_concurrency`
+    per endpoint. With a bulk format, messages are grouped `max_messages` at a time into a single body.
+    Messages that can't be delivered are passed to on_failure(endpoint, messages, error), which returns
+    True when it took them over; it runs in its own thread, as spooling writes and syncs files.
+    Bodies are compressed by the compressor, if any. The requests are timed under the stats lock,
+    take_timings() returning the timings collected since its last call.
+    """
+
+    def __init__(self, concurrency=8, endpoint_concurrency=8, queue_size=1000, fmt="none", max_messages=500,
+                 connect_timeout=5.0, read_timeout=30.0, on_failure=None, compressor=None):
+        if fmt != "none" and fmt not in idmefv2_bulk.FORMATS:
+            raise ValueError(f"Unknown bulk format '{fmt}'")
+        self.concurrency = max(1, concurrency)
+        self.endpoint_concurrency = max(1, endpoint_concurrency)
+        self.queue_size = queue_size
+        self.fmt = fmt
+        self.max_messages = max_messages if fmt != "none" else 1
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.on_failure = on_failure
+        self.compressor = compressor
+        self.pending = {}
+        self.endpoints = {}
+        self.stats_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.deferred = 0
+        self.timings = idmefv2_metrics.Stage()
+        self.loop = None
+        self.failure_executor = None
+
+    def start(self):
+        """
+        Starts the event loop thread and the workers.
+        """
+        self.loop = asyncio.new_event_loop()
+        if self.on_failure is not None:
+            self.failure_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="idmefv2-async-failure")
+        self.thread = threading.Thread(target=self.loop.run_forever, name="idmefv2-async-sender", daemon=True)
+        self.thread.start()
+        self.call(self.start_workers())
+        return self
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def start_workers(self):
+        self.queue = asyncio.Queue(self.queue_size)
+        self.workers = [asyncio.ensure_future(self.work()) for _ in range(self.concurrency)]
+
+    def submit(self, endpoint, message):
+        """
+        Queues a message, blocking while the queue is full.
+        """
+        batch = self.pending.setdefault(endpoint, [])
+        batch.append(message)
+        if len(batch) >= self.max_messages:
+            del self.pending[endpoint]
+            self.call(self.queue.put((endpoint, batch)))
+
+    def flush(self):
+        """
+        Queues the incomplete bulk batches.
+        """
+        pending, self.pending = self.pending, {}
+        for endpoint, batch in pending.items():
+            self.call(self.queue.put((endpoint, batch)))
+
+    def join(self):
+        """
+        Waits until every submitted message has been delivered or failed.
+        """
+        self.flush()
+        self.call(self.queue.join())
+
+    def close(self):
+        if self.loop is None:
+            return
+        self.join()
+        self.call(self.stop_workers())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+        if self.failure_executor is not None:
+            self.failure_executor.shutdown()
+            self.failure_executor = None
+
+    async def stop_workers(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        for endpoint in self.endpoints.values():
+            endpoint.close()
+
+    def take_timings(self):
+        """
+        Returns the idmefv2_metrics.Stage of the requests sent since the last call.
+        """
+        with self.stats_lock:
+            timings, self.timings = self.timings, idmefv2_metrics.Stage()
+        return timings
+
+    def encode(self, batch):
+        if self.fmt == "none":
+            return idmefv2_encoding.dumps(batch[0]), "application/json"
+        return idmefv2_encoding.encode_batch(self.fmt, batch), idmefv2_bulk.FORMATS[self.fmt]
+
+    async def work(self):
+        while True:
+            url, batch = await self.queue.get()
+            try:
+                await self.deliver(url, batch)
+            except Exception as e:
+                with self.stats_lock:
+                    self.failed += len(batch)
+                logger.error("Asynchronous delivery of %d messages failed: %s", len(batch), e, exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    async def deliver(self, url, batch):
+        body, content_type = self.encode(batch)
+        content_encoding = None
+        if self.compressor is not None:
+            body, content_encoding = self.compressor.compress(body)
+        # Requests overlap on the loop thread, each one is timed separately
+        start = time.perf_counter_ns()
+        try:
+            endpoint = self.endpoints.get(url)
+            if endpoint is None:
+                endpoint = self.endpoints[url] = Endpoint(url, self.endpoint_concurrency)
+            status = await endpoint.post(body, content_type, self.connect_timeout, self.read_timeout, content_encoding)
+            error = None if 200 <= status < 300 else idmefv2_bulk.DeliveryError.from_status(status)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            error = idmefv2_bulk.DeliveryError(f"{type(e).__name__}: {e}")
+        except ValueError as e:
+            error = idmefv2_bulk.DeliveryError(str(e), retryable=False)
+        with self.stats_lock:
+            self.timings.add(time.perf_counter_ns() - start)
+            if error is None:
+                self.sent += len(batch)
+                return
+        if self.on_failure is not None and await self.loop.run_in_executor(
+                self.failure_executor, self.on_failure, url, batch, error):
+            with self.stats_lock:
+                self.deferred += len(batch)
+            return
+        with self.stats_lock:
+            self.failed += len(batch)
+        logger.error("%d messages not sent: %s", len(batch), error)
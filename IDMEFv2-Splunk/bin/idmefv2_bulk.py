@@ -0,0 +1,143 @@
+"""
+Bulk delivery of IDMEFv2 messages.
+
+Messages are grouped into a single request body, either as a JSON array or as newline-delimited JSON,
+and a batch is sent when it reaches a number of messages or bytes, or when its oldest message
+has waited for the linger time.
+"""
+
+import time
+import threading
+import logging
+
+import idmefv2_encoding
+
+logger = logging.getLogger("idmefv2_connector")
+
+# Body format -> Content-Type
+FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+}
+
+# Statuses rejecting the content of a batch: it is split in half to isolate the bad messages
+SPLIT_STATUSES = (400, 413, 422)
+
+class DeliveryError(Exception):
+    """
+    Delivery failure of IDMEFv2 messages.
+    It is retryable unless the endpoint rejected the messages themselves (4xx status).
+    """
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+    @classmethod
+    def from_status(cls, status, text=""):
+        retryable = status >= 500 or status in (408, 429)
+        return cls(f"API call returned status {status}: {text}".rstrip(": "), retryable)
+
+class BulkSender:
+    """
+    Groups messages into bulk requests sent through post(body, content_type), which returns the HTTP status
+    (or raises a DeliveryError, any other exception being a retryable failure).
+    Messages that can't be delivered are passed to on_failure(messages, error), which returns True
+    when it took them over (e.g. spooled them for a later retry).
+    """
+
+    def __init__(self, post, fmt="json", max_messages=500, max_bytes=4194304, linger=1.0, on_failure=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown bulk format '{fmt}', expected one of {', '.join(FORMATS)}")
+        self.post = post
+        self.fmt = fmt
+        self.content_type = FORMATS[fmt]
+        self.max_messages = max(1, max_messages)
+        self.max_bytes = max_bytes
+        self.linger = linger
+        self.on_failure = on_failure
+        self.lock = threading.RLock()
+        # Messages of the batch, whose encoded form is written in the body as they are added
+        self.pending = []
+        self.writer = idmefv2_encoding.BodyWriter(fmt)
+        self.first_added = None
+        self.requests = 0
+        self.sent = 0
+        self.failed = 0
+        self.deferred = 0
+
+    def add(self, message):
+        """
+        Queues a message, sending the batch when it is full.
+        """
+        encoded = idmefv2_encoding.dumps(message)
+        with self.lock:
+            # One separator per message
+            if self.pending and self.writer.size() + len(encoded) + 1 > self.max_bytes:
+                self.flush()
+            if not self.pending:
+                self.first_added = time.monotonic()
+            self.pending.append(message)
+            self.writer.add(encoded)
+            if len(self.pending) >= self.max_messages or self.writer.size() >= self.max_bytes:
+                self.flush()
+
+    def expired(self, now=None):
+        with self.lock:
+            if not self.pending:
+                return False
+            return (now or time.monotonic()) - self.first_added >= self.linger
+
+    def flush_if_expired(self):
+        """
+        Sends the pending batch if its oldest message has waited for the linger time.
+        """
+        with self.lock:
+            if self.expired():
+                self.flush()
+
+    def flush(self):
+        """
+        Sends the pending batch.
+        """
+        with self.lock:
+            messages = self.pending
+            self.pending = []
+            body, spans = self.writer.take()
+            self.first_added = None
+            if messages:
+                self.send(list(zip(messages, spans)), body, body)
+
+    def send(self, batch, source, body=None):
+        """
+        Sends the (message, span) pairs of a batch, whose encoded messages are at their span of
+        the source body. The body of a part of the batch is sliced from the source.
+        """
+        if body is None:
+            body = idmefv2_encoding.slice_body(self.fmt, source, [span for _, span in batch])
+        try:
+            status = self.post(body, self.content_type)
+        except DeliveryError as e:
+            self.fail(batch, e)
+            return
+        except Exception as e:
+            self.fail(batch, DeliveryError(str(e)))
+            return
+        self.requests += 1
+        if 200 <= status < 300:
+            self.sent += len(batch)
+            logger.debug("Bulk request of %d messages sent.", len(batch))
+            return
+        if len(batch) > 1 and status in SPLIT_STATUSES:
+            logger.warning("Bulk request of %d messages rejected with status %d, splitting it.", len(batch), status)
+            middle = len(batch) // 2
+            self.send(batch[:middle], source)
+            self.send(batch[middle:], source)
+            return
+        self.fail(batch, DeliveryError.from_status(status))
+
+    def fail(self, batch, error):
+        if self.on_failure is not None and self.on_failure([message for message, _ in batch], error):
+            self.deferred += len(batch)
+            return
+        self.failed += len(batch)
+        logger.error("%d messages not sent: %s", len(batch), error)
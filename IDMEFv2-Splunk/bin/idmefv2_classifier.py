@@ -0,0 +1,259 @@
+"""
+Rule based classification of Splunk events.
+
+All the keywords are compiled into a single regular expression shaped as a trie of their characters,
+so that the event text is scanned once whatever the number of keywords.
+Rule tables are loaded from JSON files and the compiled tables are cached on disk.
+"""
+
+import os
+import re
+import json
+import pickle
+import hashlib
+import logging
+
+logger = logging.getLogger("idmefv2_connector")
+
+# Bumped whenever the pickled classes change, to discard the older caches
+CACHE_VERSION = 2
+
+def trie_pattern(keywords):
+    """
+    Builds a regular expression matching any of the keywords, factoring their common prefixes.
+    At a given position the longest matching keyword is matched.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Greedy optional group: the longer keywords are tried first
+        return "(?:" + pattern + ")?" if "" in node else pattern
+
+    return build(trie)
+
+class KeywordClassifier:
+    """
+    Classifies a text according to (keyword, value) rules listed by decreasing priority:
+    the value of the first rule whose keyword occurs in the lowercased text is returned.
+    """
+
+    def __init__(self, rules, default):
+        self.default = default
+        self.values = []
+        self.ranks = {}
+        for keyword, value in rules:
+            keyword = keyword.lower()
+            if keyword and keyword not in self.ranks:
+                self.ranks[keyword] = len(self.values)
+                self.values.append(value)
+        self.regex = re.compile(trie_pattern(self.ranks)) if self.ranks else None
+        # Only the longest keyword is matched at a position, its shorter prefixes are checked from here
+        self.prefixes = {
+            keyword: [self.ranks[keyword[:i]] for i in range(1, len(keyword)) if keyword[:i] in self.ranks]
+            for keyword in self.ranks
+        }
+        self.keywords = list(self.ranks)
+
+    def best_rank(self, text):
+        """
+        Returns the rank of the highest priority keyword found in the lowercased text, or None.
+        """
+        if self.regex is None:
+            return None
+        best = None
+        search = self.regex.search
+        match = search(text)
+        while match is not None:
+            keyword = match.group()
+            rank = self.ranks[keyword]
+            for prefix_rank in self.prefixes[keyword]:
+                rank = min(rank, prefix_rank)
+            if best is None or rank < best:
+                best = rank
+                if best == 0:
+                    break
+            # Restart right after the match start, to find the overlapping keywords as well
+            match = search(text, match.start() + 1)
+        return best
+
+    def found(self, text):
+        """
+        Returns every keyword found in the lowercased text.
+        """
+        if self.regex is None:
+            return set()
+        ranks = set()
+        search = self.regex.search
+        match = search(text)
+        while match is not None:
+            keyword = match.group()
+            ranks.add(self.ranks[keyword])
+            ranks.update(self.prefixes[keyword])
+            match = search(text, match.start() + 1)
+        return {self.keywords[rank] for rank in ranks}
+
+    def classify(self, text):
+        rank = self.best_rank(text)
+        return self.default if rank is None else self.values[rank]
+
+class RuleTable:
+    """
+    Classification table whose rules are evaluated by decreasing "priority" (default 0), then in order:
+    - {"keyword": k, "value": v}: k occurs in the lowercased text of the event
+    - {"regex": r, "value": v}: r matches the lowercased text of the event
+    - {"field": f, "equals": e, "value": v}: field f of the event is equal to e
+    - {"field": f, "regex": r, "value": v}: r matches field f of the event
+    The value of the first matching rule is returned, or the default one.
+    """
+
+    def __init__(self, rules, default):
+        self.default = default
+        ordered = sorted(enumerate(rules), key=lambda item: (-item[1].get("priority", 0), item[0]))
+        self.values = []
+        keywords = []
+        # field -> {expected value: rank}, checked with one lookup per field
+        self.field_index = {}
+        # (rank, field or None for the text, compiled regex), by rank
+        self.regexes = []
+        for rank, (_, rule) in enumerate(ordered):
+            if "value" not in rule:
+                raise ValueError(f"Classification rule without value: {rule}")
+            self.values.append(rule["value"])
+            if "field" in rule and "equals" in rule:
+                self.field_index.setdefault(rule["field"], {}).setdefault(str(rule["equals"]), rank)
+            elif "regex" in rule:
+                self.regexes.append((rank, rule.get("field"), re.compile(rule["regex"])))
+            elif "keyword" in rule and "field" not in rule:
+                keywords.append((rule["keyword"], rank))
+            else:
+                raise ValueError(f"Invalid classification rule: {rule}")
+        self.keywords = KeywordClassifier(keywords, None)
+
+    def evaluate(self, text, event=None):
+        """
+        Classifies the lowercased text of an event, and the event fields if given.
+        """
+        return self.resolve(self.keywords.classify(text), text, event)
+
+    def resolve(self, best, text, event=None):
+        """
+        Classifies an event whose best keyword rank is already known.
+        """
+        if event is not None:
+            for field, expected in self.field_index.items():
+                value = event.get(field)
+                if value is not None:
+                    rank = expected.get(str(value))
+                    if rank is not None and (best is None or rank < best):
+                        best = rank
+        for rank, field, regex in self.regexes:
+            if best is not None and rank >= best:
+                break
+            subject = text if field is None else (event.get(field) if event is not None else None)
+            if subject is not None and regex.search(str(subject)):
+                best = rank
+                break
+        return self.default if best is None else self.values[best]
+
+class RuleSet:
+    """
+    Named classification tables, e.g. "category" and "service".
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+        # The keywords of every table, so that an event text is scanned once for all the tables
+        self.scanner = KeywordClassifier(
+            [(keyword, None) for table in tables.values() for keyword in table.keywords.ranks], None
+        )
+
+    @classmethod
+    def from_definitions(cls, definitions):
+        """
+        Compiles {name: {"default": value, "rules": [...]}} definitions.
+        """
+        return cls({name: RuleTable(table.get("rules", []), table.get("default")) for name, table in definitions.items()})
+
+    def evaluate(self, name, text, event=None):
+        return self.tables[name].evaluate(text, event)
+
+    def extract(self, text, event=None):
+        """
+        Classifies the lowercased text of an event, and the event fields if given, with every table
+        in a single scan of the text. Returns {table name: value}.
+        """
+        found = self.scanner.found(text)
+        features = {}
+        for name, table in self.tables.items():
+            ranks = table.keywords.ranks
+            best = min((ranks[keyword] for keyword in found if keyword in ranks), default=None)
+            features[name] = table.resolve(best, text, event)
+        return features
+
+def merge_definitions(documents):
+    """
+    Merges rule documents listed by decreasing precedence: for each table the rules of the first
+    documents come first, and the first default value is kept.
+    """
+    merged = {}
+    for document in documents:
+        for name, table in document.items():
+            target = merged.setdefault(name, {"rules": []})
+            target["rules"].extend(table.get("rules", []))
+            if "default" in table and "default" not in target:
+                target["default"] = table["default"]
+    return merged
+
+def load_rules(paths, cache_path=None):
+    """
+    Loads and compiles the rule files listed by decreasing precedence (e.g. local/ then default/),
+    skipping the missing ones.
+    The compiled rules are cached in cache_path, which is reused while the rule files keep the same
+    modification time and size, or the same content.
+    """
+    paths = [p for p in paths if os.path.isfile(p)]
+    stats = [(p, os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in paths]
+
+    cached = None
+    if cache_path and os.path.isfile(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get("version") != CACHE_VERSION:
+                cached = None
+            elif cached["stats"] == stats:
+                return cached["rules"]
+        except Exception as e:
+            logger.warning("Ignoring the classification rules cache %s: %s", cache_path, e)
+            cached = None
+
+    contents = []
+    for path in paths:
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    digest = hashlib.sha256(b"\0".join(contents)).hexdigest()
+    if cached is not None and cached.get("digest") == digest:
+        rules = cached["rules"]
+    else:
+        rules = RuleSet.from_definitions(merge_definitions([json.loads(c) for c in contents]))
+
+    if cache_path:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # Each process writes its own temporary file, concurrent rebuilds replace the cache atomically
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"version": CACHE_VERSION, "stats": stats, "digest": digest, "rules": rules}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning("Unable to write the classification rules cache %s: %s", cache_path, e)
+    return rules
@@ -0,0 +1,163 @@
+"""
+Serialization of the IDMEFv2 messages.
+
+Messages are encoded straight to compact UTF-8 JSON bytes, with orjson when it is installed.
+Bulk bodies are written message by message into a reused buffer, so that a batch is copied
+once when it is sent instead of being joined and concatenated.
+Request bodies can be compressed with gzip, deflate, or zstd when zstandard is installed.
+"""
+
+import json
+import logging
+import threading
+
+# The optional encoders and the compression modules are imported on first use,
+# a payload handed off to the forwarder does not need them
+orjson = None
+_orjson_imported = False
+
+logger = logging.getLogger("idmefv2_connector")
+
+_encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+def dumps(message):
+    """
+    Encodes a message to compact JSON bytes.
+    """
+    global orjson, _orjson_imported
+    if not _orjson_imported:
+        _orjson_imported = True
+        try:
+            import orjson
+        except ImportError:
+            pass
+    if orjson is not None:
+        try:
+            return orjson.dumps(message)
+        except TypeError:
+            # e.g. integers over 64 bits or non-str keys, which the json module accepts
+            pass
+    return _encoder.encode(message).encode("utf-8")
+
+class BodyWriter:
+    """
+    Writes encoded messages into a bulk body, as a JSON array ("json") or newline-delimited JSON ("ndjson").
+    The position of each message in the body is kept, to build the body of a part of the batch.
+    """
+
+    def __init__(self, fmt="json"):
+        if fmt not in ("json", "ndjson"):
+            raise ValueError(f"Unknown bulk format '{fmt}', expected one of json, ndjson")
+        self.fmt = fmt
+        self.buffer = bytearray()
+        self.spans = []
+
+    def __len__(self):
+        return len(self.spans)
+
+    def size(self):
+        """
+        Size of the body once terminated.
+        """
+        return len(self.buffer) + (1 if self.fmt == "json" else 0)
+
+    def add(self, encoded):
+        buffer = self.buffer
+        if self.fmt == "json":
+            buffer += b"," if self.spans else b"["
+        start = len(buffer)
+        buffer += encoded
+        self.spans.append((start, len(buffer)))
+        if self.fmt == "ndjson":
+            buffer += b"\n"
+
+    def take(self):
+        """
+        Returns the body and the (start, end) span of every message in it, and empties the writer.
+        """
+        if not self.spans:
+            return b"", []
+        if self.fmt == "json":
+            self.buffer += b"]"
+        # requests only sends bytes bodies, this is the single copy of the batch
+        body = bytes(self.buffer)
+        spans = self.spans
+        del self.buffer[:]
+        self.spans = []
+        return body, spans
+
+def encode_batch(fmt, messages):
+    """
+    Encodes messages into a bulk body.
+    """
+    writer = BodyWriter(fmt)
+    for message in messages:
+        writer.add(dumps(message))
+    return writer.take()[0]
+
+def slice_body(fmt, body, spans):
+    """
+    Builds the body of the messages at the given spans of a bulk body, without re-encoding them.
+    """
+    view = memoryview(body)
+    writer = BodyWriter(fmt)
+    for start, end in spans:
+        writer.add(view[start:end])
+    return writer.take()[0]
+
+_zstd_warned = False
+
+# Compression -> default level
+COMPRESSIONS = {
+    "none": None,
+    "gzip": 6,
+    "deflate": 6,
+    "zstd": 3,
+}
+
+class Compressor:
+    """
+    Compresses the request bodies of at least min_bytes bytes, level 0 being the default level
+    of the method. A "zstd" compressor falls back to gzip when zstandard is not installed.
+    """
+
+    def __init__(self, method="none", level=0, min_bytes=1024):
+        if method not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{method}', expected one of {', '.join(COMPRESSIONS)}")
+        zstandard = None
+        if method == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                pass
+        if method == "zstd" and zstandard is None:
+            global _zstd_warned
+            if not _zstd_warned:
+                logger.warning("zstandard is not installed, compressing with gzip instead of zstd.")
+                _zstd_warned = True
+            method = "gzip"
+        self.method = method
+        self.level = level or COMPRESSIONS[method]
+        if method in ("gzip", "deflate"):
+            self.level = min(max(self.level, 1), 9)
+        self.min_bytes = min_bytes
+        self.zstandard = zstandard
+        # zstd compression contexts can't be shared between threads
+        self.local = threading.local()
+
+    def compress(self, body):
+        """
+        Returns the body to send and its Content-Encoding, None if it is sent as is.
+        """
+        if self.method == "none" or len(body) < self.min_bytes:
+            return body, None
+        if self.method == "gzip":
+            import gzip
+            return gzip.compress(body, compresslevel=self.level, mtime=0), "gzip"
+        if self.method == "deflate":
+            import zlib
+            return zlib.compress(body, self.level), "deflate"
+        context = getattr(self.local, "zstd", None)
+        if context is None:
+            context = self.local.zstd = self.zstandard.ZstdCompressor(level=self.level)
+        return context.compress(body), "zstd"
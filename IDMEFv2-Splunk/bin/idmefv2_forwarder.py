@@ -0,0 +1,140 @@
+"""
+Local forwarder daemon for the IDMEFv2 connector.
+
+The alert action hands the raw Splunk payload off through a Unix socket and returns right away,
+while the long-lived forwarder keeps the compiled template, the HTTP connections and the log files open
+and processes the payloads in a background worker.
+"""
+
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import logging
+
+logger = logging.getLogger("idmefv2_connector")
+
+DEFAULT_SOCKET_PATH = os.path.join(
+    os.environ.get("SPLUNK_HOME", "."),
+    "var", "run", "splunk", "idmefv2_forwarder.sock"
+)
+
+# Sent back once the payload has been queued
+ACK = b"OK\n"
+# Sent back when the queue is full, the alert action then processes the payload itself
+NACK = b"NO\n"
+
+class ForwarderRunning(Exception):
+    pass
+
+def hand_off(raw_payload, socket_path=DEFAULT_SOCKET_PATH, timeout=2.0):
+    """
+    Writes a raw payload to the forwarder socket.
+    Returns True when the forwarder queued it, False if no forwarder is available or its queue is full.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(raw_payload)
+            sock.shutdown(socket.SHUT_WR)
+            return sock.recv(len(ACK)) == ACK
+    except OSError as e:
+        logger.debug("Forwarder not available on %s: %s", socket_path, e)
+        return False
+
+def is_running(socket_path):
+    """
+    Checks whether a forwarder is listening on the given socket.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(1.0)
+            sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+class PayloadHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        data = self.rfile.read()
+        if not data:
+            return
+        # A payload is only acknowledged once queued: waiting for room in the queue could outlast
+        # the client timeout, and the payload would then be processed by both sides
+        try:
+            self.server.payloads.put_nowait(data)
+        except queue.Full:
+            logger.warning("Forwarder queue full, the alert action processes the payload itself.")
+            self.wfile.write(NACK)
+            return
+        self.wfile.write(ACK)
+
+class Forwarder(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix socket server queuing the received payloads for a single worker thread,
+    which calls process(payload_bytes) for each of them, and tick() at least every tick_interval seconds.
+    """
+    daemon_threads = True
+
+    def __init__(self, process, socket_path=DEFAULT_SOCKET_PATH, queue_size=1000, tick=None, tick_interval=0.5):
+        self.process = process
+        self.tick = tick
+        self.tick_interval = tick_interval
+        self.socket_path = socket_path
+        self.payloads = queue.Queue(queue_size)
+        self.worker = threading.Thread(target=self.work, name="idmefv2-forwarder-worker", daemon=True)
+
+        if os.path.exists(socket_path):
+            if is_running(socket_path):
+                raise ForwarderRunning(f"A forwarder is already listening on {socket_path}")
+            os.unlink(socket_path)
+        os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+
+        super().__init__(socket_path, PayloadHandler)
+        os.chmod(socket_path, 0o600)
+
+    def work(self):
+        next_tick = time.monotonic() + self.tick_interval
+        while True:
+            try:
+                data = self.payloads.get(timeout=max(0, next_tick - time.monotonic()))
+            except queue.Empty:
+                data = b""
+            if data is None:
+                break
+            if data:
+                try:
+                    self.process(data)
+                except Exception as e:
+                    logger.error("Forwarder failed to process a payload: %s", e, exc_info=True)
+            if time.monotonic() >= next_tick:
+                next_tick = time.monotonic() + self.tick_interval
+                if self.tick is not None:
+                    try:
+                        self.tick()
+                    except Exception as e:
+                        logger.error("Forwarder periodic task failed: %s", e, exc_info=True)
+
+    def serve(self):
+        """
+        Processes payloads until shutdown() is called, then drains the queued ones.
+        """
+        logger.info("Forwarder listening on %s", self.socket_path)
+        self.worker.start()
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+            self.payloads.put(None)
+            self.worker.join()
+            logger.info("Forwarder stopped.")
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
@@ -0,0 +1,179 @@
+"""
+Logging helpers of the IDMEFv2 connector.
+
+Records are formatted by the logging thread, put on a queue and written to the log file by a
+background thread, in batches, so that the conversion and delivery loops never wait for the disk.
+Payloads, results and IDMEFv2 messages are logged as lazy records: they are only serialized,
+compactly and truncated to a maximum length, when their level is enabled and they are sampled.
+"""
+
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+import threading
+
+logger = logging.getLogger("idmefv2_connector")
+
+LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "NONE": None,
+}
+
+class BatchFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Rotating file handler writing a batch of records with a single write, size check and flush.
+    """
+
+    def emit_batch(self, records):
+        self.acquire()
+        try:
+            text = "".join(self.format(record) + self.terminator for record in records)
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes > 0 and self.stream.tell() + len(text) >= self.maxBytes:
+                self.doRollover()
+            self.stream.write(text)
+            self.flush()
+        except Exception:
+            self.handleError(records[-1])
+        finally:
+            self.release()
+
+class BatchQueueWriter:
+    """
+    Background thread handing the records waiting in a queue to the handlers in batches
+    of at most batch_size records, the handlers' levels being respected.
+    """
+
+    # Put on the queue by stop(), after the last record to write
+    STOP = object()
+
+    def __init__(self, record_queue, *handlers, batch_size=512):
+        self.queue = record_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="idmefv2-log-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Writes the records already queued and stops the thread.
+        """
+        if self.thread is not None:
+            self.queue.put(self.STOP)
+            self.thread.join()
+            self.thread = None
+
+    def handle_batch(self, records):
+        for handler in self.handlers:
+            accepted = [r for r in records if r.levelno >= handler.level]
+            if not accepted:
+                continue
+            if hasattr(handler, "emit_batch"):
+                handler.emit_batch(accepted)
+            else:
+                for record in accepted:
+                    handler.handle(record)
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            record = self.queue.get()
+            while record is not self.STOP:
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            else:
+                stopping = True
+            if batch:
+                self.handle_batch(batch)
+
+_writer = None
+
+def start_logging(logger_obj, log_path, max_bytes=2500000000, backup_count=5,
+                  fmt='%(asctime)s %(levelname)s %(message)s'):
+    """
+    Attaches a queue handler to the logger and starts the background writer of the log file.
+    The pending records are written when the process exits, or by stop_logging.
+    """
+    global _writer
+    file_handler = BatchFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(logging.Formatter(fmt))
+    record_queue = queue.SimpleQueue()
+    logger_obj.addHandler(logging.handlers.QueueHandler(record_queue))
+    _writer = BatchQueueWriter(record_queue, file_handler)
+    _writer.start()
+    atexit.register(stop_logging)
+    return logger_obj
+
+def stop_logging():
+    """
+    Writes the pending records and stops the background writer.
+    """
+    global _writer
+    if _writer is not None:
+        writer, _writer = _writer, None
+        writer.stop()
+        for handler in writer.handlers:
+            handler.close()
+
+class LazyJSON:
+    """
+    Log record argument serialized to JSON when the record is formatted.
+    """
+
+    __slots__ = ("obj", "max_chars")
+
+    def __init__(self, obj, max_chars=0):
+        self.obj = obj
+        self.max_chars = max_chars
+
+    def __str__(self):
+        try:
+            text = json.dumps(self.obj, separators=(",", ":"), default=str)
+        except (TypeError, ValueError) as e:
+            text = f"<not serializable: {e}>"
+        if self.max_chars and len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}... ({len(text)} chars)"
+        return text
+
+class PayloadLogger:
+    """
+    Logs payloads at a configurable level ("NONE" disables them), for a sample of the results only
+    if sample_rate is lower than 1.
+    """
+
+    def __init__(self, level="DEBUG", max_chars=4096, sample_rate=1.0, log=logger):
+        if level not in LEVELS:
+            logger.warning("Invalid payload log level '%s', defaulting to 'DEBUG'", level)
+            level = "DEBUG"
+        self.level = LEVELS[level]
+        self.max_chars = max(0, max_chars)
+        self.sample_rate = sample_rate
+        self.log = log
+
+    def enabled(self):
+        """
+        Tells whether the next payload is logged, drawing the sample.
+        The serialization is skipped altogether when it returns False.
+        """
+        if self.level is None or not self.log.isEnabledFor(self.level):
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def payload(self, msg, obj):
+        self.log.log(self.level, msg, LazyJSON(obj, self.max_chars))
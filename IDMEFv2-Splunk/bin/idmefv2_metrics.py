@@ -0,0 +1,121 @@
+"""
+Lightweight stage timers of the IDMEFv2 connector.
+
+Each stage accumulates its call count, total and maximum duration. The aggregates are emitted
+as a single JSON line per alert action, or per interval in the forwarder, whose "metric_name:"
+keys can be ingested as is into a Splunk metrics index.
+"""
+
+import os
+import time
+import json
+import logging
+import logging.handlers
+
+METRIC_PREFIX = "idmefv2."
+
+DEFAULT_METRICS_LOG = os.path.join(
+    os.environ.get("SPLUNK_HOME", "."),
+    "var", "log", "splunk", "idmefv2_connector_metrics.log"
+)
+
+perf_counter_ns = time.perf_counter_ns
+
+class Stage:
+    """
+    Timer of a stage, used as a context manager. A stage must not be timed by several threads.
+    """
+
+    __slots__ = ("count", "total_ns", "max_ns", "_start")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self._start = 0
+
+    def __enter__(self):
+        self._start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.add(perf_counter_ns() - self._start)
+        return False
+
+    def add(self, elapsed_ns):
+        self.count += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+
+    def merge(self, other):
+        """
+        Adds the calls timed by another stage, e.g. one collected by another thread.
+        """
+        self.count += other.count
+        self.total_ns += other.total_ns
+        if other.max_ns > self.max_ns:
+            self.max_ns = other.max_ns
+
+class Metrics:
+    """
+    Stage timers and counters aggregated until the next emit.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.started = time.time()
+
+    def stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage()
+        return stage
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self, **dimensions):
+        """
+        Returns the aggregates as a metrics record, with the given dimensions.
+        """
+        now = time.time()
+        record = {"time": round(now, 3)}
+        record.update(dimensions)
+        record["metric_name:" + METRIC_PREFIX + "interval_ms"] = round((now - self.started) * 1e3, 3)
+        for name, stage in self.stages.items():
+            if stage.count:
+                key = "metric_name:" + METRIC_PREFIX + name
+                record[key + ".count"] = stage.count
+                record[key + ".total_ms"] = round(stage.total_ns / 1e6, 3)
+                record[key + ".max_ms"] = round(stage.max_ns / 1e6, 3)
+        for name, value in self.counters.items():
+            record["metric_name:" + METRIC_PREFIX + name] = value
+        return record
+
+    def reset(self):
+        for stage in self.stages.values():
+            stage.count = stage.total_ns = stage.max_ns = 0
+        self.counters = {}
+        self.started = time.time()
+
+    def emit(self, log, **dimensions):
+        """
+        Logs the aggregates as one JSON line and starts a new interval.
+        """
+        log.info("%s", json.dumps(self.snapshot(**dimensions), separators=(",", ":")))
+        self.reset()
+
+def metrics_logger(log_path=DEFAULT_METRICS_LOG):
+    """
+    Returns the logger of the metrics file, whose lines are the bare JSON records.
+    """
+    logger_obj = logging.getLogger("idmefv2_metrics")
+    if not logger_obj.handlers:
+        logger_obj.propagate = False
+        logger_obj.setLevel(logging.INFO)
+        handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=25000000, backupCount=5, delay=True)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger_obj.addHandler(handler)
+    return logger_obj
@@ -0,0 +1,167 @@
+"""
+Routing of the alert results to their conversion template.
+
+A route matches the search_name, app and sourcetype of a result against exact values or
+wildcard patterns (* and ?), and gives the template of the results it matches. Routes are
+tried by decreasing precedence: the exact ones are found through a hash index, the wildcard
+ones are matched in order, and the template of each (search_name, app, sourcetype) is memoized,
+so that routing a result costs a dict lookup.
+
+Route files (local/ then default/idmefv2_template_routes.json) list routes as:
+    {"routes": [{"search_name": "Brute Force*", "sourcetype": "linux_secure", "template": "idmefv2_template_auth.json"}]}
+where "template" is a template file, looked up like the route files, or an inline template.
+"""
+
+import os
+import re
+import json
+import fnmatch
+import logging
+
+logger = logging.getLogger("idmefv2_connector")
+
+ROUTE_KEYS = ("search_name", "app", "sourcetype")
+
+# Route values memoized before the memo is cleared
+MEMO_SIZE = 4096
+
+def is_pattern(value):
+    return "*" in value or "?" in value or "[" in value
+
+def route_value(value):
+    """
+    Returns the value of a route key of a result, as a string (the first value of a multivalue field).
+    """
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return None if value is None else str(value)
+
+class TemplateRouter:
+    """
+    Converts each result with the converter of the first route it matches, or with the default converter.
+    Routes are (patterns, converter) pairs by decreasing precedence, patterns mapping route keys to values.
+    """
+
+    def __init__(self, routes, default):
+        self.default = default
+        # Route keys -> {values: (rank, converter)}
+        self.exact = {}
+        # (rank, [(key index, regex)], converter)
+        self.wildcards = []
+        for rank, (patterns, converter) in enumerate(routes):
+            unknown = set(patterns) - set(ROUTE_KEYS)
+            if unknown:
+                raise ValueError(f"Unknown route keys {sorted(unknown)}, expected some of {', '.join(ROUTE_KEYS)}")
+            keys = tuple(k for k in ROUTE_KEYS if k in patterns)
+            values = tuple(str(patterns[k]) for k in keys)
+            if any(is_pattern(v) for v in values):
+                regexes = [(ROUTE_KEYS.index(k), re.compile(fnmatch.translate(v))) for k, v in zip(keys, values)]
+                self.wildcards.append((rank, regexes, converter))
+            else:
+                index = self.exact.setdefault(tuple(ROUTE_KEYS.index(k) for k in keys), {})
+                index.setdefault(values, (rank, converter))
+        self.memo = {}
+
+    def __len__(self):
+        return sum(len(index) for index in self.exact.values()) + len(self.wildcards)
+
+    def resolve(self, values):
+        """
+        Returns the converter of the (search_name, app, sourcetype) values.
+        """
+        best = None
+        for positions, index in self.exact.items():
+            match = index.get(tuple(values[i] for i in positions))
+            if match is not None and (best is None or match[0] < best[0]):
+                best = match
+        for rank, regexes, converter in self.wildcards:
+            if best is not None and rank > best[0]:
+                break
+            if all(values[i] is not None and regex.match(values[i]) for i, regex in regexes):
+                best = (rank, converter)
+                break
+        return self.default if best is None else best[1]
+
+    def route(self, src):
+        values = (route_value(src.get("search_name")), route_value(src.get("app")), route_value(src.get("sourcetype")))
+        converter = self.memo.get(values)
+        if converter is None:
+            converter = self.resolve(values)
+            if len(self.memo) >= MEMO_SIZE:
+                self.memo.clear()
+            self.memo[values] = converter
+        return converter
+
+    def convert(self, src):
+        """
+        Converts a result like JSONConverter.convert, with the template of its route.
+        """
+        return self.route(src).convert(src)
+
+    def convert_many(self, columns, size=None):
+        """
+        Converts a batch of results given as columns like JSONConverter.convert_many,
+        each template converting the columns of its results.
+        """
+        if size is None:
+            if not columns:
+                raise ValueError("The number of rows of a batch without columns must be given")
+            size = len(next(iter(columns.values())))
+        keys = [columns.get(key) or [None] * size for key in ROUTE_KEYS]
+        groups = {}
+        for i, values in enumerate(zip(*keys)):
+            converter = self.route(dict(zip(ROUTE_KEYS, values)))
+            groups.setdefault(converter, []).append(i)
+        if len(groups) == 1:
+            return next(iter(groups)).convert_many(columns, size)
+        output = [None] * size
+        for converter, indexes in groups.items():
+            group = {name: [column[i] for i in indexes] for name, column in columns.items()}
+            for i, message in zip(indexes, converter.convert_many(group, len(indexes))):
+                output[i] = message
+        return output
+
+def find_file(name, directories):
+    for directory in directories:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return path
+    raise ValueError(f"Template file '{name}' not found in {', '.join(directories)}")
+
+def load_router(paths, directories, build, default):
+    """
+    Loads the route files listed by decreasing precedence (e.g. local/ then default/), skipping the
+    missing ones, and compiles each template once with build(template, name), name being the path of
+    the template file, or the route file and index of an inline template.
+    Template files are looked up in directories. Returns default if there is no route.
+    """
+    from JSONConverter import JSONConverter
+
+    routes = []
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        with open(path, "rb") as f:
+            definition = json.loads(f.read())
+        routes.extend((path, index, route) for index, route in enumerate(definition.get("routes", [])))
+    if not routes:
+        return default
+
+    converters = {}
+    compiled = []
+    for path, index, route in routes:
+        route = dict(route)
+        template = route.pop("template", None)
+        if isinstance(template, str):
+            converter = converters.get(template)
+            if converter is None:
+                template_path = find_file(template, directories)
+                converter = converters[template] = build(JSONConverter.load_template(template_path), template_path)
+        elif isinstance(template, dict):
+            converter = build(template, f"{path}#{index}")
+        else:
+            raise ValueError(f"Route {route} has no template")
+        compiled.append((route, converter))
+    router = TemplateRouter(compiled, default)
+    logger.info("Loaded %d template routes", len(router))
+    return router
@@ -0,0 +1,348 @@
+"""
+Durable on-disk spool of the IDMEFv2 messages that could not be delivered.
+
+Messages are appended as JSON lines to numbered segment files, in one queue directory per endpoint,
+the oldest segments being dropped when the spool exceeds its size limit. The drainer replays the
+segments of each queue in order and, when its endpoint is still unavailable, waits for an exponentially
+growing delay before the next attempt of that endpoint, the other queues being drained meanwhile.
+"""
+
+import os
+import json
+import time
+import hashlib
+import fcntl
+import logging
+from contextlib import contextmanager
+
+import idmefv2_encoding
+
+logger = logging.getLogger("idmefv2_connector")
+
+DEFAULT_SPOOL_DIR = os.path.join(
+    os.environ.get("SPLUNK_HOME", "."),
+    "var", "spool", "idmefv2"
+)
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".ndjson"
+
+@contextmanager
+def locked_file(path, blocking=True):
+    """
+    Holds an exclusive lock on a file; yields False if non-blocking and already held.
+    """
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def endpoint_key(endpoint):
+    """
+    Name of the queue directory of an endpoint.
+    """
+    return hashlib.sha1(endpoint.encode("utf-8")).hexdigest()[:16]
+
+class EndpointQueue:
+    """
+    Segments, backoff state and drain cursor of the messages spooled for one endpoint,
+    so that an unavailable endpoint neither defers nor blocks the messages of the others.
+    """
+
+    def __init__(self, spool, directory, endpoint):
+        self.spool = spool
+        self.directory = directory
+        self.endpoint = endpoint
+        self.state_path = os.path.join(directory, "state.json")
+
+    def lock(self, name, blocking=True):
+        """
+        Holds an exclusive lock file of the queue; yields False if non-blocking and already held.
+        """
+        return locked_file(os.path.join(self.directory, name), blocking)
+
+    def segments(self):
+        """
+        Returns the segment file names, oldest first.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(n for n in names if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX))
+
+    def segment_name(self, number):
+        return "%s%012d%s" % (SEGMENT_PREFIX, number, SEGMENT_SUFFIX)
+
+    def segment_number(self, name):
+        return int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+    def size(self, segments=None):
+        total = 0
+        for name in self.segments() if segments is None else segments:
+            try:
+                total += os.path.getsize(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        return total
+
+    def read_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"failures": 0, "next_attempt": 0, "segment": None, "offset": 0}
+
+    def write_state(self, state):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def backing_off(self):
+        """
+        True while the endpoint is considered unavailable: its new messages should be spooled, not sent.
+        """
+        return time.time() < self.read_state().get("next_attempt", 0)
+
+    def backoff(self, state):
+        # Delays the next delivery attempt exponentially with the consecutive failures; returns the delay
+        state["failures"] = state.get("failures", 0) + 1
+        delay = min(self.spool.backoff_max, self.spool.backoff_base * 2 ** (state["failures"] - 1))
+        state["next_attempt"] = time.time() + delay
+        self.write_state(state)
+        return delay
+
+    def record_failure(self):
+        """
+        Records a failed delivery outside of the drainer, so that the next messages are spooled
+        until the backoff delay expires.
+        """
+        with self.lock(".drain.lock", blocking=False) as locked:
+            if locked:
+                state = self.read_state()
+                if time.time() >= state.get("next_attempt", 0):
+                    self.backoff(state)
+
+    def write(self, lines):
+        # Appends encoded records to the active segment, the caller holding the spool append lock
+        segments = self.segments()
+        if not segments or self.size(segments[-1:]) >= self.spool.segment_bytes:
+            segments.append(self.segment_name(self.segment_number(segments[-1]) + 1 if segments else 1))
+        fd = os.open(os.path.join(self.directory, segments[-1]), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            for i, line in enumerate(lines, 1):
+                os.write(fd, line)
+                if i % self.spool.fsync_every == 0:
+                    os.fsync(fd)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def seal(self):
+        """
+        Starts a new active segment so that the existing ones can be drained; returns them.
+        """
+        with self.spool.lock(".append.lock"):
+            segments = self.segments()
+            if segments and self.size(segments[-1:]) > 0:
+                open(os.path.join(self.directory, self.segment_name(self.segment_number(segments[-1]) + 1)), "a").close()
+                return segments
+            return segments[:-1]
+
+    def drain(self, send, batch_size=500, force=False):
+        """
+        Replays the spooled messages through send(endpoint, messages), which raises when they can't be delivered.
+        Delivery resumes from the last acknowledged batch; after a failure the next attempt is delayed
+        exponentially unless force is set. Returns the number of delivered messages.
+        """
+        state = self.read_state()
+        if not force and time.time() < state.get("next_attempt", 0):
+            return 0
+        delivered = 0
+        with self.lock(".drain.lock", blocking=False) as locked:
+            if not locked:
+                return 0
+            state = self.read_state()
+            for name in self.seal():
+                path = os.path.join(self.directory, name)
+                offset = state["offset"] if state.get("segment") == name else 0
+                try:
+                    for messages, offset in self.read_batches(path, offset, batch_size):
+                        send(self.endpoint, messages)
+                        delivered += len(messages)
+                        state.update(segment=name, offset=offset)
+                        self.write_state(state)
+                except Exception as e:
+                    delay = self.backoff(state)
+                    logger.warning("Spool drain for %s failed after %d messages, next attempt in %.0fs: %s",
+                                   self.endpoint, delivered, delay, e)
+                    return delivered
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                state.update(segment=None, offset=0)
+            if delivered or state.get("failures"):
+                state.update(failures=0, next_attempt=0)
+                self.write_state(state)
+        if delivered:
+            logger.info("%d spooled messages delivered to %s.", delivered, self.endpoint)
+        return delivered
+
+    def read_batches(self, path, offset, batch_size):
+        """
+        Yields (messages, end offset) batches of records.
+        """
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(offset)
+            messages = []
+            for line in f:
+                end = offset + len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipping a corrupted record in spool segment %s.", path)
+                    offset = end
+                    continue
+                if len(messages) >= batch_size:
+                    yield messages, offset
+                    messages = []
+                messages.append(record["message"])
+                offset = end
+            if messages:
+                yield messages, offset
+
+class Spool:
+    """
+    Append-only spool shared by the alert action processes and the forwarder, with one queue per endpoint.
+    Appends are serialized with an exclusive lock, a single process drains each queue at a time.
+    """
+
+    def __init__(self, directory=DEFAULT_SPOOL_DIR, max_bytes=268435456, segment_bytes=4194304,
+                 fsync_every=100, backoff_base=5.0, backoff_max=600.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync_every = max(1, fsync_every)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._queues = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def lock(self, name, blocking=True):
+        """
+        Holds an exclusive lock file of the spool; yields False if non-blocking and already held.
+        """
+        return locked_file(os.path.join(self.directory, name), blocking)
+
+    def queue(self, endpoint):
+        """
+        Returns the queue of an endpoint, created on first use.
+        """
+        queue = self._queues.get(endpoint)
+        if queue is None:
+            directory = os.path.join(self.directory, endpoint_key(endpoint))
+            path = os.path.join(directory, "endpoint")
+            if not os.path.isfile(path):
+                os.makedirs(directory, exist_ok=True)
+                tmp_path = "%s.%d.tmp" % (path, os.getpid())
+                with open(tmp_path, "w") as f:
+                    f.write(endpoint)
+                os.replace(tmp_path, path)
+            queue = self._queues[endpoint] = EndpointQueue(self, directory, endpoint)
+        return queue
+
+    def queues(self):
+        """
+        Returns the queues of every endpoint with spooled messages, or that had some.
+        """
+        queues = []
+        for name in sorted(os.listdir(self.directory)):
+            try:
+                with open(os.path.join(self.directory, name, "endpoint")) as f:
+                    endpoint = f.read()
+            except OSError:
+                continue
+            if endpoint:
+                queues.append(self.queue(endpoint))
+        return queues
+
+    def backing_off(self, endpoint):
+        """
+        True while the endpoint is considered unavailable: its new messages should be spooled, not sent.
+        """
+        return self.queue(endpoint).backing_off()
+
+    def record_failure(self, endpoint):
+        """
+        Records a failed delivery to the endpoint outside of the drainer.
+        """
+        self.queue(endpoint).record_failure()
+
+    def size(self):
+        return sum(queue.size() for queue in self.queues())
+
+    def pending(self):
+        """
+        True if spooled messages are waiting for delivery.
+        """
+        return self.size() > 0
+
+    def enforce_limit(self, incoming):
+        # Drops the oldest segments of every queue, the active ones excepted, to make room for the incoming bytes
+        candidates = []
+        total = incoming
+        for queue in self.queues():
+            segments = queue.segments()
+            total += queue.size(segments)
+            for name in segments[:-1]:
+                path = os.path.join(queue.directory, name)
+                try:
+                    candidates.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        dropped = 0
+        for _, path in sorted(candidates):
+            if total <= self.max_bytes:
+                break
+            try:
+                total -= os.path.getsize(path)
+                os.unlink(path)
+                dropped += 1
+            except OSError:
+                pass
+        if dropped:
+            logger.warning("Spool over %d bytes, %d oldest segments dropped.", self.max_bytes, dropped)
+
+    def append(self, endpoint, messages):
+        """
+        Appends undelivered messages for the endpoint, with one fsync every fsync_every messages.
+        """
+        lines = [idmefv2_encoding.dumps({"endpoint": endpoint, "message": m}) + b"\n" for m in messages]
+        if not lines:
+            return
+        queue = self.queue(endpoint)
+        with self.lock(".append.lock"):
+            self.enforce_limit(sum(len(line) for line in lines))
+            queue.write(lines)
+        logger.warning("%d messages for %s spooled to %s.", len(lines), endpoint, queue.directory)
+
+    def drain(self, send, batch_size=500, force=False):
+        """
+        Replays the messages of every endpoint queue through send(endpoint, messages), each queue
+        backing off on its own. Returns the number of delivered messages.
+        """
+        return sum(queue.drain(send, batch_size, force) for queue in self.queues())
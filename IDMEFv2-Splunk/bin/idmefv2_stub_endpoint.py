@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an IDMEFv2 server, to test the connector and the forwarder without a real endpoint.
+Every POST is answered with status 200 and counted; with --verbose the received bodies are printed.
+
+Usage: python3 idmefv2_stub_endpoint.py [--host 127.0.0.1] [--port 8088] [--verbose]
+"""
+
+import argparse
+import gzip
+import sys
+import zlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.record(self.headers, body)
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class StubEndpoint(ThreadingHTTPServer):
+    """
+    HTTP server accepting IDMEFv2 POSTs; requests and received bytes are counted.
+    """
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, status=200, verbose=False):
+        super().__init__((host, port), StubHandler)
+        self.status = status
+        self.verbose = verbose
+        self.requests = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def record(self, headers, body):
+        with self.lock:
+            self.requests += 1
+            self.bytes += len(body)
+        if self.verbose:
+            encoding = headers.get("Content-Encoding")
+            if encoding == "gzip":
+                body = gzip.decompress(body)
+            elif encoding == "deflate":
+                body = zlib.decompress(body)
+            sys.stdout.write(body.decode("utf-8", "replace") + "\n")
+            sys.stdout.flush()
+
+    def start(self):
+        """
+        Serves in a background thread, returns the endpoint URL.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.url
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in IDMEFv2 endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--status", type=int, default=200, help="HTTP status returned to every POST")
+    parser.add_argument("--verbose", action="store_true", help="print the received bodies")
+    args = parser.parse_args()
+
+    server = StubEndpoint(args.host, args.port, args.status, args.verbose)
+    sys.stderr.write(f"Stub IDMEFv2 endpoint listening on {server.url}\n")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stderr.write(f"{server.requests} requests, {server.bytes} bytes received\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 import sys
+import hashlib
+import importlib
 import logging
 
 import ply.lex
@@ -18,12 +20,59 @@ class JsonPathLexer:
         if self.__doc__ is None:
             raise JsonPathLexerError('Docstrings have been removed! By design of PLY, jsonpath-rw requires docstrings. You must not use PYTHONOPTIMIZE=2 or python -OO.')
 
+    # Module holding the pre-generated lexer tables, see jsonpath_ng.tables
+    lextab_module = 'jsonpath_ng.lexer_lextab'
+
+    # Master lexers built once per lexer class, cloned by tokenize()
+    _master_lexers = {}
+
+    def signature(self):
+        '''
+        Digest of the lexer specification, used to validate pre-generated tables.
+        '''
+        parts = [repr(sorted(self.tokens)), repr(self.literals), repr(self.states)]
+        for name in sorted(dir(self)):
+            if not name.startswith('t_'):
+                continue
+            rule = getattr(self, name)
+            if callable(rule):
+                parts.append('%s:%s:%s' % (name, rule.__code__.co_firstlineno, rule.__doc__))
+            else:
+                parts.append('%s:%s' % (name, rule))
+        return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def build(self, lextab=None):
+        '''
+        Builds a PLY lexer from the given tables module, or from reflection when
+        it is missing or does not match the lexer specification.
+        '''
+        if lextab is not None and getattr(lextab, '_signature', None) == self.signature():
+            return ply.lex.lex(module=self, optimize=1, lextab=lextab, errorlog=logger)
+        if lextab is not None:
+            logger.debug('Lexer tables %s are out of date, building from the grammar', lextab.__name__)
+        return ply.lex.lex(module=self, debug=self.debug, errorlog=logger)
+
+    def master_lexer(self):
+        if self.debug:
+            return self.build()
+        cls = type(self)
+        master = JsonPathLexer._master_lexers.get(cls)
+        if master is None:
+            try:
+                lextab = importlib.import_module(self.lextab_module)
+            except ImportError:
+                lextab = None
+            master = self.build(lextab)
+            JsonPathLexer._master_lexers[cls] = master
+        return master
+
     def tokenize(self, string):
         '''
         Maps a string to an iterator over tokens. In other words: [char] -> [token]
         '''
 
-        new_lexer = ply.lex.lex(module=self, debug=self.debug, errorlog=logger)
+        new_lexer = self.master_lexer().clone()
+        new_lexer.lexstatestack = []
         new_lexer.latest_newline = 0
         new_lexer.string_value = None
         new_lexer.input(string)
@@ -1,6 +1,8 @@
+import functools
 import logging
 import sys
 import os.path
+import threading
 
 import ply.yacc
 
@@ -11,8 +13,42 @@ from jsonpath_ng.lexer import JsonPathLexer
 logger = logging.getLogger(__name__)
 
 
+# Maximum number of expressions kept in the parse() cache
+PARSE_CACHE_SIZE = 1024
+
+_parser = None
+_parser_lock = threading.Lock()
+
+
 def parse(string):
-    return JsonPathParser().parse(string)
+    '''
+    Parses a JsonPath expression using a process-wide parser.
+
+    The resulting ASTs are cached by expression string, so they are shared
+    between callers and must not be modified.
+    '''
+    return _parse_cached(string)
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_cached(string):
+    global _parser
+    # PLY parsers are not reentrant, the singleton is shared under a lock
+    with _parser_lock:
+        if _parser is None:
+            _parser = JsonPathParser()
+        return _parser.parse(string)
+
+
+def parse_cache_info():
+    '''
+    Returns the hits, misses, maxsize and currsize counters of the parse() cache.
+    '''
+    return _parse_cached.cache_info()
+
+
+def parse_cache_clear():
+    _parse_cached.cache_clear()
 
 
 class JsonPathParser:
@@ -22,7 +58,7 @@ class JsonPathParser:
 
     tokens = JsonPathLexer.tokens
 
-    def __init__(self, debug=False, lexer_class=None):
+    def __init__(self, debug=False, lexer_class=None, write_tables=False):
         if self.__doc__ is None:
             raise JsonPathParserError(
                 'Docstrings have been removed! By design of PLY, '
@@ -44,12 +80,13 @@ class JsonPathParser:
         start_symbol = 'jsonpath'
         parsing_table_module = '_'.join([module_name, start_symbol, 'parsetab'])
 
-        # Generate the parse table
+        # Load the parse table generated by jsonpath_ng.tables if its signature
+        # matches the grammar, generate it otherwise
         self.parser = ply.yacc.yacc(module=self,
                                     debug=self.debug,
                                     tabmodule = parsing_table_module,
                                     outputdir = output_directory,
-                                    write_tables=0,
+                                    write_tables=write_tables,
                                     start = start_symbol,
                                     errorlog = logger)
 
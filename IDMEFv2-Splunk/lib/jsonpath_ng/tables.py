@@ -0,0 +1,46 @@
+'''
+Generates the PLY tables of the JsonPath lexer and parser.
+
+Run at packaging time so that processes load the tables instead of building
+them from the grammar:
+
+    python3 -m jsonpath_ng.tables
+'''
+import logging
+import os.path
+
+from jsonpath_ng.lexer import JsonPathLexer
+from jsonpath_ng.parser import JsonPathParser
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_DIRECTORY = os.path.dirname(__file__)
+
+
+def write_lexer_table(outputdir=OUTPUT_DIRECTORY):
+    lexer = JsonPathLexer()
+    module_name = lexer.lextab_module.split('.')[-1]
+    lexer.build().writetab(module_name, outputdir)
+    # The signature lets the lexer detect tables generated from another specification
+    with open(os.path.join(outputdir, module_name + '.py'), 'a') as f:
+        f.write('_signature = %r\n' % lexer.signature())
+    return os.path.join(outputdir, module_name + '.py')
+
+
+def write_parser_table(outputdir=OUTPUT_DIRECTORY):
+    path = os.path.join(outputdir, 'parser_jsonpath_parsetab.py')
+    # PLY does not rewrite a table whose signature matches the grammar
+    if os.path.exists(path):
+        os.remove(path)
+    JsonPathParser(write_tables=True)
+    return path
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    for path in (write_lexer_table(), write_parser_table()):
+        logger.info('Generated %s', path)
+
+
+if __name__ == '__main__':
+    main()
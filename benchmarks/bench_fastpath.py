@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Measures the per-row conversion time of the connector template with and without
+the JSONConverter fast path for plain $.field JSONPaths.
+
+Usage: python3 benchmarks/bench_fastpath.py [--rows N]
+"""
+
+import argparse
+import logging
+import time
+
+from benchutil import load_connector, make_rows
+from JSONConverter import JSONConverter
+
+
+def per_row_us(converter, rows):
+    start = time.perf_counter()
+    for row in rows:
+        converter.convert(row)
+    return (time.perf_counter() - start) / len(rows) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    args = parser.parse_args()
+
+    template = load_connector().template
+    logging.disable(logging.WARNING)
+    rows = make_rows(args.rows)
+
+    jsonpath_us = per_row_us(JSONConverter(template, fast_paths=False), rows)
+    fast_us = per_row_us(JSONConverter(template), rows)
+    print("jsonpath_ng: %8.2f us/row" % jsonpath_us)
+    print("fast path:   %8.2f us/row" % fast_us)
+    print("speedup:     %8.2fx" % (jsonpath_us / fast_us))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Times each stage of the connector pipeline on synthetic Splunk results.
+
+The stages are timed separately: template compilation, preparation of the results
+(classification included), classification alone, conversion row by row and column by column
+(convert_many, per row over chunks of results), JSON serialization and HTTP delivery to a
+local stub endpoint. Each stage reports rows per second and p50/p99 latencies,
+and the peak RSS of the run is recorded. Results are written as JSON to compare them between
+commits with benchmarks/compare.py.
+
+Usage: python3 benchmarks/bench_pipeline.py [--rows N] [--width N] [--raw-size N] [--output FILE]
+"""
+
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import time
+
+import benchutil
+
+perf_counter_ns = time.perf_counter_ns
+
+
+def time_rows(function, rows):
+    """
+    Calls function on every row, returning the results and the duration of each call.
+    """
+    samples = []
+    results = []
+    for row in rows:
+        start = perf_counter_ns()
+        results.append(function(row))
+        samples.append(perf_counter_ns() - start)
+    return results, samples
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=benchutil.APP_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    connector = benchutil.load_connector()
+    # Only the pipeline is measured, not the log file
+    logging.disable(logging.CRITICAL)
+    from JSONConverter import JSONConverter
+    from idmefv2_stub_endpoint import StubEndpoint
+    import idmefv2_encoding
+
+    rows = benchutil.make_rows(args.rows, args.width, args.raw_size)
+    payload = benchutil.make_payload(rows)
+    config = payload["configuration"]
+    stages = {}
+
+    _, samples = time_rows(lambda _: JSONConverter(connector.template), range(args.compile_runs))
+    stages["compile"] = benchutil.summarize(samples)
+
+    _, samples = time_rows(connector.classify_event, rows)
+    stages["classify"] = benchutil.summarize(samples)
+
+    prepared, samples = time_rows(lambda row: connector.prepare_result(payload, config, dict(row)), rows)
+    stages["prepare"] = benchutil.summarize(samples)
+
+    converter = connector.get_converter()
+    # The converter leaves the null fields out, there is no separate cleanup pass
+    messages, samples = time_rows(lambda row: converter.convert(row)[1], prepared)
+    stages["convert"] = benchutil.summarize(samples)
+
+    # Chunks converted like the connector does in batch mode, the columns being built from the prepared results
+    size = connector.CONVERT_CHUNK_SIZE
+    chunks = [prepared[i:i + size] for i in range(0, len(prepared), size)]
+    samples = []
+    for chunk in chunks:
+        start = perf_counter_ns()
+        names = dict.fromkeys(name for row in chunk for name in row)
+        converter.convert_many({name: [row.get(name) for row in chunk] for name in names}, len(chunk))
+        samples.extend([(perf_counter_ns() - start) // len(chunk)] * len(chunk))
+    stages["convert_many"] = benchutil.summarize(samples)
+
+    bodies, samples = time_rows(idmefv2_encoding.dumps, messages)
+    stages["serialize"] = benchutil.summarize(samples)
+
+    endpoint = StubEndpoint()
+    endpoint.start()
+    try:
+        session = connector.get_http_session(config)
+        timeout = connector.get_http_timeout(config)
+        sent = messages[:args.send_rows]
+        _, samples = time_rows(
+            lambda message: connector.send_to_idmefv2_endpoint(message, endpoint.url, session, timeout), sent)
+        stages["send"] = benchutil.summarize(samples)
+    finally:
+        endpoint.shutdown()
+        endpoint.server_close()
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "parameters": {
+            "rows": args.rows,
+            "width": args.width,
+            "raw_size": args.raw_size,
+            "send_rows": args.send_rows,
+            "compile_runs": args.compile_runs,
+        },
+        "body_bytes_mean": sum(len(body) for body in bodies) / len(bodies) if bodies else 0,
+        "stages": stages,
+        "peak_rss_kb": benchutil.peak_rss_kb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000, help="synthetic results to convert")
+    parser.add_argument("--width", type=int, default=0, help="extra fields per result")
+    parser.add_argument("--raw-size", type=int, default=0, help="minimum length of the _raw field")
+    parser.add_argument("--send-rows", type=int, default=1000, help="messages sent to the stub endpoint")
+    parser.add_argument("--compile-runs", type=int, default=200, help="template compilations")
+    parser.add_argument("--output", help="JSON file receiving the results")
+    args = parser.parse_args()
+
+    results = run(args)
+    print("%-20s %12s %10s %10s %10s" % ("stage", "rows/s", "mean us", "p50 us", "p99 us"))
+    for name, stage in results["stages"].items():
+        print("%-20s %12.0f %10.2f %10.2f %10.2f" % (
+            name, stage["rows_per_s"], stage["mean_us"], stage["p50_us"], stage["p99_us"]))
+    print("peak RSS: %d kB" % results["peak_rss_kb"])
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
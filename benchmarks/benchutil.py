@@ -0,0 +1,118 @@
+"""
+Shared helpers of the benchmarks: loading the connector outside Splunk, generating synthetic
+Splunk results and summarizing the timings.
+"""
+
+import importlib.util
+import os
+import random
+import resource
+import string
+import sys
+import tempfile
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "IDMEFv2-Splunk")
+sys.path.insert(0, os.path.join(APP_DIR, "bin"))
+sys.path.insert(0, os.path.join(APP_DIR, "lib"))
+
+RAW_MESSAGES = [
+    "sshd[1234]: Failed password for invalid user admin from 10.0.0.%d port 2396",
+    "sshd[1234]: Accepted password for root from 10.0.0.%d port 2396",
+    "httpd: GET /index.html from 10.0.0.%d",
+    "kernel: port scan detected from 10.0.0.%d",
+    "sudo: admin : TTY=pts/0 ; COMMAND=/bin/sh from 10.0.0.%d",
+]
+
+
+def load_connector():
+    """
+    Imports bin/idmefv2-connector.py, logging under a temporary $SPLUNK_HOME, and registers
+    its template functions.
+    """
+    splunk_home = tempfile.mkdtemp(prefix="idmefv2-bench-")
+    os.makedirs(os.path.join(splunk_home, "var", "log", "splunk"))
+    os.environ["SPLUNK_HOME"] = splunk_home
+    spec = importlib.util.spec_from_file_location(
+        "idmefv2_connector", os.path.join(APP_DIR, "bin", "idmefv2-connector.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # The template calls connector functions, registered when the converter is first built
+    module.register_template_functions()
+    return module
+
+
+def make_rows(count, width=0, raw_size=0, seed=0):
+    """
+    Generates count Splunk results with the fields read by the template, width extra fields
+    and a _raw field padded to at least raw_size characters.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        raw = RAW_MESSAGES[i % len(RAW_MESSAGES)] % (i % 256)
+        if len(raw) < raw_size:
+            raw += " " + "".join(rng.choices(string.ascii_lowercase + " ", k=raw_size - len(raw) - 1))
+        row = {
+            "sid": "scheduler__admin__search__RMD5_at_1747048511_%d" % i,
+            "description": "User logon with misspelled or bad password",
+            "urgency": "medium",
+            "StartTime": "2025-05-12T11:15:11Z",
+            "_raw": raw,
+            "dvc_name": "SPLUNK01",
+            "dvc_host": "splunk01.example.com",
+            "category": "authentication",
+            "server_uri": "https://127.0.0.1:8089",
+            "src_ip": "10.219.15.%d" % (i % 256),
+            "src_host": "DC",
+            "src_user": "4bf69",
+            "protocol": "tcp",
+            "src_port": "2396",
+            "src_country": "IT ROM",
+            "service": "sshd",
+            "dest_port": "22",
+            "dest_country": "IT ROM",
+        }
+        for j in range(width):
+            row["extra_field_%d" % j] = "value_%d_%d" % (i, j)
+        rows.append(row)
+    return rows
+
+
+def make_payload(rows, endpoint="http://127.0.0.1:8088/"):
+    """
+    Wraps the first row in an alert action payload, as sent by Splunk.
+    """
+    return {
+        "app": "search",
+        "owner": "admin",
+        "search_name": "idmefv2-benchmark",
+        "server_uri": "https://127.0.0.1:8089",
+        "sid": "scheduler__admin__search__RMD5_at_1747048511",
+        "configuration": {"idmefv2_endpoint": endpoint, "batch_mode": "1"},
+        "result": rows[0] if rows else {},
+    }
+
+
+def summarize(samples_ns):
+    """
+    Summarizes per-row durations in nanoseconds.
+    """
+    ordered = sorted(samples_ns)
+    count = len(ordered)
+    total = sum(ordered)
+    return {
+        "rows": count,
+        "rows_per_s": count / total * 1e9 if total else 0.0,
+        "mean_us": total / count / 1e3 if count else 0.0,
+        "p50_us": ordered[count // 2] / 1e3 if count else 0.0,
+        "p99_us": ordered[min(count - 1, int(count * 0.99))] / 1e3 if count else 0.0,
+    }
+
+
+def peak_rss_kb():
+    """
+    Peak resident set size of the process, in kilobytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Checks the cold start of bin/idmefv2-connector.py.
+
+The connector is started with -X importtime and no arguments, which imports it and exits:
+the modules it imports eagerly are listed, and the heavy modules that must only be imported
+on first use are reported. Then the time from the start of an alert action process to the
+first byte received by a local stub endpoint is measured, for a payload handed off to a running
+forwarder and for a payload sent by the alert action itself.
+
+Usage: python3 benchmarks/check_startup.py [--runs N] [--max-first-byte-ms MS] [--max-direct-first-byte-ms MS]
+
+The exit status is 1 when a heavy module is imported eagerly, when the median time to the
+first byte through the forwarder exceeds --max-first-byte-ms (150 ms by default), or when the
+median time to the first byte of a direct send exceeds --max-direct-first-byte-ms, if given.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import benchutil
+
+CONNECTOR = os.path.join(benchutil.APP_DIR, "bin", "idmefv2-connector.py")
+
+# Modules that a payload handed off to the forwarder must not load
+LAZY_MODULES = ("requests", "urllib3", "jsonpath_ng", "ply", "asyncio", "JSONConverter",
+                "idmefv2_classifier", "idmefv2_async", "idmefv2_spool", "idmefv2_forwarder", "orjson")
+
+
+def splunk_home():
+    home = tempfile.mkdtemp(prefix="idmefv2-startup-")
+    os.makedirs(os.path.join(home, "var", "log", "splunk"))
+    return home
+
+
+def import_times(env):
+    """
+    Returns {top level module: cumulative import time in us} of the connector imports.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", CONNECTOR],
+                            env=env, capture_output=True, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            # Nested imports are indented by two spaces per level
+            modules[name[1:].rstrip()] = int(cumulative)
+    return modules
+
+
+def first_byte_ms(env, endpoint, payload):
+    """
+    Starts an alert action and returns the time until the endpoint received its first request.
+    """
+    received = threading.Event()
+    endpoint.record = lambda headers, body: received.set()
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, CONNECTOR, "--execute"], env=env,
+                               stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    process.stdin.write(json.dumps(payload).encode("utf-8"))
+    process.stdin.close()
+    received.wait(30)
+    elapsed = (time.perf_counter() - start) * 1e3
+    process.wait()
+    return elapsed
+
+
+def start_forwarder(env, socket_path):
+    """
+    Starts a forwarder listening on socket_path and waits until it accepts payloads.
+    """
+    process = subprocess.Popen([sys.executable, CONNECTOR, "--forwarder", "--socket", socket_path,
+                                "--metrics-interval", "0"],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while not os.path.exists(socket_path):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError("The forwarder did not start")
+        time.sleep(0.05)
+    return process
+
+
+def measure(env, endpoint, payload, runs):
+    # The first run fills the page cache and the classification rules cache
+    first_byte_ms(env, endpoint, payload)
+    samples = [first_byte_ms(env, endpoint, payload) for _ in range(runs)]
+    median = statistics.median(samples)
+    return median, "median %.1f ms, min %.1f ms, max %.1f ms" % (median, min(samples), max(samples))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="alert actions started to measure the first byte")
+    parser.add_argument("--max-first-byte-ms", type=float, default=150.0,
+                        help="median time to the first byte through the forwarder not to exceed")
+    parser.add_argument("--max-direct-first-byte-ms", type=float,
+                        help="median time to the first byte of a direct send not to exceed")
+    args = parser.parse_args()
+
+    env = dict(os.environ, SPLUNK_HOME=splunk_home())
+    sys.path.insert(0, os.path.join(benchutil.APP_DIR, "bin"))
+    from idmefv2_stub_endpoint import StubEndpoint
+
+    status = 0
+    modules = import_times(env)
+    total = sum(us for name, us in modules.items() if not name.startswith(" ") and name != "site")
+    print("eager imports: %.1f ms (interpreter site: %.1f ms)" % (total / 1e3, modules.get("site", 0) / 1e3))
+    for name, us in sorted(modules.items(), key=lambda item: -item[1]):
+        if not name.startswith(" ") and name != "site" and us >= 1000:
+            print("  %-30s %8.1f ms" % (name, us / 1e3))
+    eager = sorted({name.strip().split(".")[0] for name in modules} & set(LAZY_MODULES))
+    if eager:
+        print("imported eagerly: %s" % ", ".join(eager))
+        status = 1
+
+    endpoint = StubEndpoint()
+    endpoint.start()
+    socket_path = os.path.join(env["SPLUNK_HOME"], "forwarder.sock")
+    forwarder = start_forwarder(env, socket_path)
+    try:
+        row = benchutil.make_rows(1)[0]
+        payload = benchutil.make_payload([row], endpoint.url)
+        payload["configuration"].update(batch_mode="0", spool_enabled="0", metrics_enabled="0")
+        handed_off = json.loads(json.dumps(payload))
+        handed_off["configuration"].update(use_forwarder="1", forwarder_socket=socket_path)
+        forwarded, forwarded_summary = measure(env, endpoint, handed_off, args.runs)
+        direct, direct_summary = measure(env, endpoint, payload, args.runs)
+    finally:
+        forwarder.terminate()
+        forwarder.wait(30)
+        endpoint.shutdown()
+        endpoint.server_close()
+    print("first byte through the forwarder: %s" % forwarded_summary)
+    print("first byte of a direct send: %s" % direct_summary)
+    if forwarded > args.max_first_byte_ms:
+        print("first byte through the forwarder slower than %.1f ms" % args.max_first_byte_ms)
+        status = 1
+    if args.max_direct_first_byte_ms is not None and direct > args.max_direct_first_byte_ms:
+        print("first byte of a direct send slower than %.1f ms" % args.max_direct_first_byte_ms)
+        status = 1
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Compares two result files of benchmarks/bench_pipeline.py.
+
+Usage: python3 benchmarks/compare.py BASELINE.json CANDIDATE.json [--threshold 0.10]
+
+The exit status is 1 when the p50 latency of a stage regressed by more than the threshold.
+"""
+
+import argparse
+import json
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative p50 increase reported as a regression")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    if baseline.get("parameters") != candidate.get("parameters"):
+        print("warning: the runs have different parameters: %s / %s" % (
+            baseline.get("parameters"), candidate.get("parameters")))
+
+    print("%s -> %s" % (baseline.get("commit"), candidate.get("commit")))
+    print("%-20s %10s %10s %9s %10s %10s %9s" % (
+        "stage", "p50 us", "p50 us", "change", "p99 us", "p99 us", "change"))
+    regressions = []
+    for name, before in baseline["stages"].items():
+        after = candidate["stages"].get(name)
+        if after is None:
+            continue
+        p50 = after["p50_us"] / before["p50_us"] - 1 if before["p50_us"] else 0.0
+        p99 = after["p99_us"] / before["p99_us"] - 1 if before["p99_us"] else 0.0
+        print("%-20s %10.2f %10.2f %+8.1f%% %10.2f %10.2f %+8.1f%%" % (
+            name, before["p50_us"], after["p50_us"], p50 * 100, before["p99_us"], after["p99_us"], p99 * 100))
+        if p50 > args.threshold:
+            regressions.append(name)
+    print("peak RSS: %d kB -> %d kB" % (baseline["peak_rss_kb"], candidate["peak_rss_kb"]))
+
+    if regressions:
+        print("regressions: %s" % ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
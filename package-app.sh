@@ -35,6 +35,10 @@ rm -rf ./IDMEFv2-Splunk/app.manifest
 version="s/^version = .*/version = 1.0.$(date +"%s")/g"
 sed -i "$version" IDMEFv2-Splunk/default/app.conf
 
+# Generate the JSONPath lexer and parser tables shipped with the app
+echo "[INFO] Generating JSONPath parser tables..."
+PYTHONPATH=IDMEFv2-Splunk/lib python3 -m jsonpath_ng.tables
+
 # Package the app with slim
 echo "[INFO] Packaging the app..."
 cd releases && slim package ../IDMEFv2-Splunk
@@ -0,0 +1,152 @@
+"""
+Tests of the HTTP/1.1 client of the asynchronous delivery engine, against scripted local servers.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "IDMEFv2-Splunk", "bin"))
+
+import idmefv2_async
+
+
+class ScriptedServer:
+    """
+    Keep-alive server answering each request with the next response of its script, closing the
+    connection after a response when the script says so.
+    """
+
+    def __init__(self, responses):
+        # [(raw response, close the connection afterwards)]
+        self.responses = list(responses)
+        self.connections = 0
+        self.requests = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.url = "http://127.0.0.1:%d/idmef" % self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = next(int(line.split(b":", 1)[1]) for line in head.split(b"\r\n")
+                              if line.lower().startswith(b"content-length:"))
+                await reader.readexactly(length)
+                response, close = self.responses[self.requests]
+                self.requests += 1
+                writer.write(response)
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+OK = (b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok", False)
+
+
+class HTTPClientTest(unittest.IsolatedAsyncioTestCase):
+
+    async def serve(self, *responses):
+        server = await ScriptedServer(responses).start()
+        self.addAsyncCleanup(server.stop)
+        endpoint = idmefv2_async.Endpoint(server.url, 1)
+        self.addCleanup(endpoint.close)
+        return server, endpoint
+
+    async def post(self, endpoint, read_timeout=5.0):
+        return await endpoint.post(b'{"ID": "1"}', "application/json", 5.0, read_timeout)
+
+    async def test_content_length(self):
+        server, endpoint = await self.serve(OK, OK)
+        self.assertEqual(await self.post(endpoint), 200)
+        self.assertEqual(await self.post(endpoint), 200)
+        self.assertEqual(server.connections, 1)
+
+    async def test_chunked(self):
+        chunked = (b"HTTP/1.1 202 Accepted\r\nTransfer-Encoding: chunked\r\n\r\n"
+                   b"4\r\nsome\r\n5;ext=1\r\nthing\r\n0\r\nX-Trailer: 1\r\n\r\n", False)
+        server, endpoint = await self.serve(chunked, OK)
+        self.assertEqual(await self.post(endpoint), 202)
+        self.assertEqual(await self.post(endpoint), 200)
+        self.assertEqual(server.connections, 1)
+
+    async def test_no_content(self):
+        server, endpoint = await self.serve((b"HTTP/1.1 204 No Content\r\n\r\n", False), OK)
+        start = time.monotonic()
+        self.assertEqual(await self.post(endpoint, read_timeout=2.0), 204)
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(await self.post(endpoint), 200)
+        self.assertEqual(server.connections, 1)
+
+    async def test_interim_response(self):
+        early_hints = (b"HTTP/1.1 103 Early Hints\r\nLink: </a>\r\n\r\n"
+                       b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok", False)
+        server, endpoint = await self.serve(early_hints)
+        self.assertEqual(await self.post(endpoint), 200)
+
+    async def test_unframed_body_on_closing_connection(self):
+        server, endpoint = await self.serve((b"HTTP/1.1 200 OK\r\nConnection: close\r\n\r\nbody", True), OK)
+        self.assertEqual(await self.post(endpoint), 200)
+        self.assertEqual(await self.post(endpoint), 200)
+        self.assertEqual(server.connections, 2)
+
+    async def test_idle_connection_reuse(self):
+        server, endpoint = await self.serve(OK, OK, OK)
+        for _ in range(3):
+            self.assertEqual(await self.post(endpoint), 200)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(len(endpoint.idle), 1)
+
+    async def test_reconnect_after_server_close(self):
+        # The server closes the idle connection without announcing it
+        server, endpoint = await self.serve((OK[0], True), OK)
+        self.assertEqual(await self.post(endpoint), 200)
+        await asyncio.sleep(0.1)
+        self.assertEqual(await self.post(endpoint), 200)
+        self.assertEqual(server.connections, 2)
+
+
+class AsyncSenderTest(unittest.TestCase):
+
+    def test_no_content_is_delivered(self):
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(
+            ScriptedServer([(b"HTTP/1.1 204 No Content\r\n\r\n", False)] * 2).start())
+        failures = []
+        sender = idmefv2_async.AsyncSender(read_timeout=3.0,
+                                           on_failure=lambda *args: failures.append(args) or True)
+        # The server runs on its own loop, in a thread of its own
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        try:
+            sender.start()
+            start = time.monotonic()
+            sender.submit(server.url, {"ID": "1"})
+            sender.submit(server.url, {"ID": "2"})
+            sender.close()
+            self.assertLess(time.monotonic() - start, 2.0)
+            self.assertEqual((sender.sent, sender.failed, sender.deferred), (2, 0, 0))
+            self.assertEqual(failures, [])
+        finally:
+            asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+
+if __name__ == "__main__":
+    unittest.main()